@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from snapshot import begin_generation, commit_generation, current_generation, generation_dir, snapshot_lock
+
+try:
+    import hnswlib
+except ImportError:  # optional dependency, exact search is used without it
+    hnswlib = None
+
+INDEX_FILE = "index.bin"
+LABELS_FILE = "labels.json"
+
+
+class HNSWIndex:
+    """Approximate cosine search over one model's gallery, backed by hnswlib.
+
+    Every identity gets a stable integer label, so names can be inserted and
+    deleted incrementally without rebuilding the graph. Knobs:
+      M               graph degree; higher = better recall, more memory
+      ef_construction build-time beam width; higher = better graph, slower inserts
+      ef_search       query-time beam width; higher = better recall, slower queries
+    """
+
+    def __init__(self, dim, M=16, ef_construction=200, ef_search=64, capacity=1024):
+        if hnswlib is None:
+            raise RuntimeError("hnswlib is not installed")
+        self.dim = dim
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._lock = threading.Lock()
+        self._index = hnswlib.Index(space="cosine", dim=dim)
+        if capacity:
+            self._index.init_index(max_elements=capacity, ef_construction=ef_construction,
+                                   M=M, allow_replace_deleted=True)
+            self._index.set_ef(ef_search)
+        self._labels = {}  # name -> label
+        self._names = {}   # label -> name
+        self._next_label = 0
+        self.sync_version = None  # gallery change-log version it was saved at, if known
+
+    def __len__(self):
+        return len(self._labels)
+
+    def names(self):
+        with self._lock:
+            return set(self._labels)
+
+    def vectors(self, names):
+        """Stored (L2-normalised) vectors of the given indexed names, in order"""
+        with self._lock:
+            if not names:
+                return np.empty((0, self.dim), dtype=np.float32)
+            return np.asarray(self._index.get_items([self._labels[name] for name in names]),
+                              dtype=np.float32)
+
+    def set_ef(self, ef_search):
+        """Trade recall for latency at query time"""
+        with self._lock:
+            self.ef_search = ef_search
+            self._index.set_ef(ef_search)
+
+    def add(self, names, vectors):
+        """Insert (or replace) identities; vectors is an (n, dim) array"""
+        if len(names) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            for name in names:
+                self._remove_locked(name)
+
+            labels = np.arange(self._next_label, self._next_label + len(names))
+            self._next_label += len(names)
+
+            needed = self._index.get_current_count() + len(names)
+            if needed > self._index.get_max_elements():
+                self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+
+            self._index.add_items(vectors, labels, replace_deleted=True)
+            for name, label in zip(names, labels):
+                self._labels[name] = int(label)
+                self._names[int(label)] = name
+
+    def remove(self, name):
+        with self._lock:
+            self._remove_locked(name)
+
+    def _remove_locked(self, name):
+        label = self._labels.pop(name, None)
+        if label is not None:
+            del self._names[label]
+            self._index.mark_deleted(label)
+
+    def search(self, queries, k=1):
+        """Return (names, distances) of shape (len(queries), k), nearest first"""
+        with self._lock:
+            k = min(k, len(self._labels))
+            if k == 0 or len(queries) == 0:
+                return np.empty((len(queries), 0), dtype=object), np.empty((len(queries), 0), dtype=np.float32)
+            labels, distances = self._index.knn_query(queries, k=k)
+            names = np.array([[self._names[int(label)] for label in row] for row in labels], dtype=object)
+        return names, distances
+
+    def save(self, path, sync_version=None):
+        """Publish to a new generation under the <path>/ directory (index.bin + labels.json).
+
+        Every worker saves at exit, so the graph and its labels are written
+        together into a fresh generation while holding the directory's lock
+        and only become visible when CURRENT is switched to it; load() never
+        pairs one worker's graph with another's labels.
+        """
+        with self._lock, snapshot_lock(path):
+            generation, target = begin_generation(path)
+            self._index.save_index(os.path.join(target, INDEX_FILE))
+            meta = {
+                "dim": self.dim,
+                "M": self.M,
+                "ef_construction": self.ef_construction,
+                "next_label": self._next_label,
+                "labels": self._labels,
+                "sync_version": sync_version,
+            }
+            with open(os.path.join(target, LABELS_FILE), "w") as f:
+                json.dump(meta, f)
+            commit_generation(path, generation)
+
+    @classmethod
+    def load(cls, path, ef_search=64):
+        """Open the latest saved generation, or return None if there is no usable copy on disk"""
+        if hnswlib is None or not os.path.isdir(path):
+            return None
+        try:
+            with snapshot_lock(path):
+                generation = current_generation(path)
+                if not generation:
+                    return None
+                source = generation_dir(path, generation)
+                with open(os.path.join(source, LABELS_FILE)) as f:
+                    meta = json.load(f)
+                index = cls(meta["dim"], M=meta["M"], ef_construction=meta["ef_construction"],
+                            ef_search=ef_search, capacity=None)
+                index._index.load_index(os.path.join(source, INDEX_FILE), allow_replace_deleted=True)
+            index._index.set_ef(ef_search)
+            index._labels = {name: int(label) for name, label in meta["labels"].items()}
+            index._names = {label: name for name, label in index._labels.items()}
+            index._next_label = meta["next_label"]
+            index.sync_version = meta.get("sync_version")
+            return index
+        except Exception as e:
+            print(f"Ignoring unreadable ANN index {path}: {str(e)}")
+            return None
@@ -1,27 +1,42 @@
 import os
+import atexit
 import cv2
 import numpy as np
 import base64
 from datetime import datetime, timedelta
 from flask import Flask, request, jsonify, render_template, Response, send_from_directory
 from deepface import DeepFace
-from scipy.spatial.distance import cosine
-from pymongo import MongoClient
 from bson import ObjectId
 from gridfs import GridFS
-from urllib.parse import quote_plus
-from pymongo.server_api import ServerApi
-from io import BytesIO
+from io import BytesIO, StringIO
 from dotenv import load_dotenv
 import uuid
+import hashlib
+import json
+import csv
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from importlib import metadata as importlib_metadata
 from flask_cors import CORS  # already present, skip if duplicate
 from dotenv import load_dotenv  # already present, skip if duplicate
-from pymongo.server_api import ServerApi  # already present
 import face_recognition
 import numpy as np
 from PIL import Image
 import base64
 from io import BytesIO
+import attendance
+from cache import TTLCache
+from connection import DATABASE_NAME, get_mongo_client
+from gallery import Gallery, GalleryIndex, SubGallery
+from login_index import EncodingIndex
+from matching import normalize_rows
+from model_registry import ModelRegistry
+from predetect import PreDetector
+from roster import ROSTER_FIELDS, RosterGalleries
+from stats import AttendanceStats
+from tenants import KnownTenants, TenantPool, tenant_dirname, tenant_filter
 # Load environment variables
 load_dotenv()
 
@@ -71,48 +86,138 @@ MODELS = {
     }
 }
 
-# Initialize models
-for model_name, config in MODELS.items():
-    if config["enabled"]:
-        try:
-            MODELS[model_name]["model"] = DeepFace.build_model(model_name)
-            print(f"Initialized {model_name} model successfully")
-        except Exception as e:
-            print(f"Error initializing {model_name}: {str(e)}")
-            MODELS[model_name]["enabled"] = False
+# Stored with every embedding so vectors from different model releases can be told apart
+try:
+    EMBEDDING_VERSION = "deepface-" + importlib_metadata.version("deepface")
+except Exception:
+    EMBEDDING_VERSION = "deepface-unknown"
+
+# Approximate nearest-neighbour search for large galleries. "exact" keeps the
+# brute-force matrix product; "hnsw" needs the optional hnswlib package.
+ANN_CONFIG = {
+    "backend": os.getenv("ANN_BACKEND", "exact"),
+    "min_size": int(os.getenv("ANN_MIN_SIZE", "5000")),  # use exact search below this
+    "index_dir": os.getenv("ANN_INDEX_DIR", "ann_indexes"),
+    "M": int(os.getenv("HNSW_M", "16")),  # recall / memory
+    "ef_construction": int(os.getenv("HNSW_EF_CONSTRUCTION", "200")),  # build quality
+    "ef_search": int(os.getenv("HNSW_EF_SEARCH", "64"))  # recall / latency
+}
 
-# MongoDB Atlas Connection
-def get_mongo_client():
-    try:
-        username = quote_plus(os.getenv("MONGO_USERNAME", "campustechnology"))
-        password = quote_plus(os.getenv("MONGO_PASSWORD", ""))
-        cluster_url = os.getenv("MONGO_CLUSTER", "cluster0.ns6jg36.mongodb.net")
-        
-        if not password:
-            raise ValueError("MongoDB password not configured")
+# Memory-mapped gallery snapshot on local disk, shared by all gunicorn workers
+# through the page cache; set GALLERY_SNAPSHOT_DIR="" to keep private copies.
+# Registers/deletes reach other workers through the change log right away; the
+# snapshot (a full rewrite) is republished at most every GALLERY_SNAPSHOT_PUBLISH
+GALLERY_SNAPSHOT = {
+    "dir": os.getenv("GALLERY_SNAPSHOT_DIR", "gallery_snapshot"),
+    "poll_interval": float(os.getenv("GALLERY_SNAPSHOT_POLL", "1.0")),  # seconds between checks
+    "publish_interval": float(os.getenv("GALLERY_SNAPSHOT_PUBLISH", "30"))  # seconds between rewrites
+}
 
-        uri = f"mongodb+srv://{username}:{password}@{cluster_url}/?retryWrites=true&w=majority&appName=Cluster0"
-        
-        client = MongoClient(
-            uri,
-            server_api=ServerApi('1'),
-            connectTimeoutMS=5000,
-            socketTimeoutMS=30000,
-            serverSelectionTimeoutMS=5000
-        )
-        
-        client.admin.command('ping')
-        print("Successfully connected to MongoDB Atlas!")
-        return client
-        
+# Cross-worker invalidation: every register/delete is logged with a version
+# number in Mongo and other workers replay just those changes. Polling costs
+# one find_one per GALLERY_SYNC_POLL seconds; GALLERY_CHANGE_STREAM=true also
+# applies changes as they happen where change streams are supported.
+GALLERY_SYNC = {
+    "poll_interval": float(os.getenv("GALLERY_SYNC_POLL", "1.0")),
+    "change_stream": os.getenv("GALLERY_CHANGE_STREAM", "false").lower() == "true"
+}
+
+# Per-college (colid) partitions of the gallery and the login index, loaded on
+# first use; least recently used colleges are evicted once the matrices of
+# each pool exceed its budget or it holds more than TENANT_MAX colleges. Only
+# colids found on students or participants are accepted (an unknown one is
+# re-checked after TENANT_KNOWN_TTL seconds); /register_user creates them
+TENANT_MEMORY = {
+    "gallery_bytes": int(float(os.getenv("TENANT_GALLERY_MB", "1024")) * 1024 * 1024),
+    "login_bytes": int(float(os.getenv("TENANT_LOGIN_MB", "256")) * 1024 * 1024),
+    "max_tenants": int(os.getenv("TENANT_MAX", "64")),
+    "known_ttl": int(os.getenv("TENANT_KNOWN_TTL", "10"))
+}
+
+# How the enabled models run for each request: "thread" runs them in parallel
+# (TensorFlow releases the GIL during inference), "sequential" one after another
+MODEL_EXECUTOR = os.getenv("MODEL_EXECUTOR", "thread")
+MODEL_WORKERS = int(os.getenv("MODEL_WORKERS", str(len(MODELS))))
+model_pool = (ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix="model")
+              if MODEL_EXECUTOR == "thread" else None)
+
+# Cascaded early exit: run models cheapest first and stop for a face once
+# "quorum" models agree, or one model's top-1 beats its top-2 by "margin"
+EARLY_EXIT = {
+    "enabled": os.getenv("EARLY_EXIT", "false").lower() == "true",
+    "order": [m.strip() for m in os.getenv(
+        "EARLY_EXIT_ORDER", "SFace,ArcFace,Facenet,Facenet512,DeepFace").split(",") if m.strip()],
+    "quorum": int(os.getenv("EARLY_EXIT_QUORUM", "3")),
+    "margin": float(os.getenv("EARLY_EXIT_MARGIN", "0.15"))
+}
+
+# Unknown faces returned by /api/identify get an opaque token that lets
+# /api/register_unknown reuse their crop and embeddings until it expires
+face_tokens = TTLCache(maxsize=int(os.getenv("FACE_TOKEN_MAX", "256")),
+                       ttl=int(os.getenv("FACE_TOKEN_TTL", "600")))
+
+# Recent match_faces() results keyed by image hash, for resubmitted frames
+result_cache = TTLCache(maxsize=int(os.getenv("RESULT_CACHE_MAX", "128")),
+                        ttl=int(os.getenv("RESULT_CACHE_TTL", "60")))
+
+# Participant profiles shown by /api/identify, keyed by gallery version so a
+# register or delete anywhere invalidates them
+profile_cache = TTLCache(maxsize=int(os.getenv("PROFILE_CACHE_MAX", "1024")),
+                        ttl=int(os.getenv("PROFILE_CACHE_TTL", "60")))
+
+# Sub-galleries per event/class/course roster for /api/identify
+ROSTER_CACHE = {
+    "max": int(os.getenv("ROSTER_CACHE_MAX", "64")),
+    "ttl": int(os.getenv("ROSTER_CACHE_TTL", "300"))
+}
+
+# Maximum number of face crops sent through a model in one forward pass
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+
+# Cheap pre-detection on a downscaled frame before RetinaFace/MTCNN:
+# "haar", "yunet" (set PREDETECT_YUNET_MODEL to the ONNX file) or "off".
+# Frames are downscaled towards PREDETECT_MAX_SIDE, but only as far as keeps
+# faces of PREDETECT_MIN_FACE pixels detectable
+PREDETECT = {
+    "backend": os.getenv("PREDETECT", "haar"),
+    "max_side": int(os.getenv("PREDETECT_MAX_SIDE", "640")),
+    "min_face": int(os.getenv("PREDETECT_MIN_FACE", "40")),
+    "padding": float(os.getenv("PREDETECT_PADDING", "0.6")),
+    "yunet_model": os.getenv("PREDETECT_YUNET_MODEL", "")
+}
+predetector = None
+if PREDETECT["backend"] != "off":
+    try:
+        predetector = PreDetector(PREDETECT["backend"], max_side=PREDETECT["max_side"],
+                                  padding=PREDETECT["padding"],
+                                  yunet_model=PREDETECT["yunet_model"],
+                                  min_face=PREDETECT["min_face"])
     except Exception as e:
-        print(f"Failed to connect to MongoDB: {str(e)}")
-        raise
+        print(f"Pre-detector disabled: {str(e)}")
+
+# Face detectors tried in order by extract_faces()
+DETECTORS = ["retinaface", "mtcnn"]  # Removed opencv as it's less accurate
+
+# When models are built: "eager" at import, "background" in a warm-up thread
+# while the server starts, "lazy" on first use. Either way every model and
+# detector gets one dummy inference before it is reported ready; with "lazy"
+# /api/ready does not wait for models that have not been used yet.
+MODEL_LOADING = os.getenv("MODEL_LOADING", "background")
+WARMUP_FRAME = np.zeros((224, 224, 3), dtype=np.uint8)
+
+model_registry = ModelRegistry(
+    MODELS, DETECTORS,
+    build_model=DeepFace.build_model,
+    warm_up_model=lambda model_name: get_embeddings_batch([WARMUP_FRAME], model_name),
+    warm_up_detector=lambda detector: DeepFace.extract_faces(
+        img_path=WARMUP_FRAME, detector_backend=detector, enforce_detection=False),
+    lazy=MODEL_LOADING == "lazy"
+)
 
 # Initialize MongoDB
 try:
     client = get_mongo_client()
-    db = client["face_recognition_db"]
+    db = client[DATABASE_NAME]
     fs = GridFS(db)
 except Exception as e:
     print(f"Critical MongoDB connection error: {str(e)}")
@@ -128,9 +233,19 @@ def initialize_database():
             db.create_collection(collection)
             print(f"Created collection: {collection}")
     
-    db.participants.create_index("name", unique=True)
-    db.face_embeddings.create_index("name", unique=True)
+    # Names are unique within a college (colid), not across colleges
+    for collection in (db.participants, db.face_embeddings):
+        if "name_1" in collection.index_information():
+            collection.drop_index("name_1")
+        collection.create_index([("colid", 1), ("name", 1)], unique=True)
+    db.students.create_index("colid")  # known colids (tenants.KnownTenants)
     db.attendance.create_index([("name", 1), ("event", 1), ("timestamp", 1)])
+    db.attendance.create_index([("participant_id", 1), ("timestamp", -1)])
+    # Keyset pagination and exports of /api/attendance, with and without the event filter
+    db.attendance.create_index([("timestamp", -1), ("_id", -1)])
+    db.attendance.create_index([("event", 1), ("timestamp", -1), ("_id", -1)])
+    attendance.ensure_indexes(db)
+    AttendanceStats(db).ensure_indexes()
     print("Database initialized successfully")
 
 initialize_database()
@@ -162,43 +277,67 @@ def verify_image(img):
         img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
     return img
 
+def offset_facial_area(area, x0, y0):
+    """Shift a facial_area detected inside a crop back to full-frame coordinates"""
+    area = dict(area)
+    area['x'] += x0
+    area['y'] += y0
+    for key in ('left_eye', 'right_eye'):
+        if isinstance(area.get(key), (tuple, list)) and len(area[key]) == 2:
+            area[key] = (area[key][0] + x0, area[key][1] + y0)
+    return area
+
 def extract_faces(image):
-    """Detect faces in image using multiple detectors with enhanced parameters"""
-    detectors = ["retinaface", "mtcnn"]  # Removed opencv as it's less accurate
+    """Detect faces in image using multiple detectors with enhanced parameters
     
-    for detector in detectors:
-        try:
-            faces = DeepFace.extract_faces(
-                img_path=image,
-                detector_backend=detector,
-                enforce_detection=True,
-                align=True,
-                expand_percentage=15,  # Increased from 10 to capture more context
-                grayscale=False
-            )
-            
-            valid_faces = []
-            for face in faces:
-                if face['confidence'] > 0.95:  # Increased confidence threshold
-                    face_img = verify_image(face['face'])
-                    valid_faces.append({
-                        'face': face_img,
-                        'area': face['facial_area'],
-                        'confidence': face['confidence']
-                    })
-            
-            if valid_faces:
-                print(f"Found {len(valid_faces)} faces using {detector} detector")
-                return valid_faces
+    When a pre-detector is configured it scans a downscaled copy first: frames
+    without a face never reach RetinaFace/MTCNN, and the heavy detectors only
+    see the candidate regions.
+    """
+    if predetector is not None:
+        regions = predetector.regions(image)
+        if not regions:
+            return []
+    else:
+        regions = [(0, 0, image.shape[1], image.shape[0])]
+    
+    for detector in DETECTORS:
+        model_registry.ensure_detector(detector)
+        valid_faces = []
+        for x0, y0, x1, y1 in regions:
+            try:
+                faces = DeepFace.extract_faces(
+                    img_path=image[y0:y1, x0:x1],
+                    detector_backend=detector,
+                    enforce_detection=True,
+                    align=True,
+                    expand_percentage=15,  # Increased from 10 to capture more context
+                    grayscale=False
+                )
                 
-        except Exception as e:
-            print(f"Error with {detector} detector: {str(e)}")
-            continue
+                for face in faces:
+                    if face['confidence'] > 0.95:  # Increased confidence threshold
+                        face_img = verify_image(face['face'])
+                        valid_faces.append({
+                            'face': face_img,
+                            'area': offset_facial_area(face['facial_area'], x0, y0),
+                            'confidence': face['confidence']
+                        })
+                    
+            except Exception as e:
+                print(f"Error with {detector} detector: {str(e)}")
+                continue
+        
+        if valid_faces:
+            print(f"Found {len(valid_faces)} faces using {detector} detector")
+            return valid_faces
     
     return []
 
 def get_embeddings(image, model_name):
     """Get face embeddings using specified model"""
+    if model_registry.ensure(model_name) is None:
+        return None
     try:
         embedding = DeepFace.represent(
             img_path=image,
@@ -211,61 +350,219 @@ def get_embeddings(image, model_name):
         print(f"Error getting {model_name} embedding: {str(e)}")
         return None
 
-def load_known_faces():
-    """Load face embeddings from MongoDB with enhanced caching"""
-    known = {}
-    for model_name, config in MODELS.items():
-        if config["enabled"]:
-            known[model_name] = []
-            for doc in db.face_embeddings.find({}, {"embeddings." + model_name: 1, "name": 1}):
-                if model_name in doc.get("embeddings", {}):
-                    known[model_name].append((doc["name"], doc["embeddings"][model_name]))
-    
-    return known
-
-def match_faces(image):
-    """Enhanced face matching with multiple models and voting system"""
-    known_faces = load_known_faces()
-    faces = extract_faces(image)
+def preprocess_face(image, target_size):
+    """Resize and pad an aligned crop exactly like DeepFace.represent does"""
+    img = image[:, :, ::-1]  # represent() flips the channel order first
     
-    if not faces:
-        return []
+    factor = min(target_size[0] / img.shape[0], target_size[1] / img.shape[1])
+    img = cv2.resize(img, (int(img.shape[1] * factor), int(img.shape[0] * factor)))
     
-    results = []
-    for face in faces:
-        model_votes = {}
+    diff_0 = target_size[0] - img.shape[0]
+    diff_1 = target_size[1] - img.shape[1]
+    img = np.pad(img, ((diff_0 // 2, diff_0 - diff_0 // 2),
+                       (diff_1 // 2, diff_1 - diff_1 // 2), (0, 0)), "constant")
+    if img.shape[0:2] != tuple(target_size):
+        img = cv2.resize(img, (target_size[1], target_size[0]))
+    
+    img = img.astype(np.float32)
+    if img.max() > 1:
+        img /= 255.0
+    return img
+
+def get_embeddings_batch(images, model_name):
+    """Embed several aligned crops with one forward pass per EMBED_BATCH_SIZE faces.
+    
+    Calls the Keras model held in MODELS[model_name]["model"] directly. Models
+    that are not Keras graphs (e.g. SFace runs on OpenCV) fall back to
+    get_embeddings() per face. Returns one embedding (or None) per image.
+    """
+    client = model_registry.ensure(model_name)
+    if client is None:
+        return [None] * len(images)
+    keras_model = getattr(client, "model", client)
+    if not (hasattr(keras_model, "input_shape") and hasattr(keras_model, "predict_on_batch")):
+        return [get_embeddings(image, model_name) for image in images]
+    
+    try:
+        target_size = tuple(keras_model.input_shape[1:3])
+        embeddings = []
+        for start in range(0, len(images), EMBED_BATCH_SIZE):
+            chunk = images[start:start + EMBED_BATCH_SIZE]
+            batch = np.stack([preprocess_face(image, target_size) for image in chunk])
+            output = keras_model(batch, training=False).numpy()
+            embeddings.extend(row.tolist() for row in output)
+        return embeddings
+    except Exception as e:
+        print(f"Batched {model_name} embedding failed, falling back per face: {str(e)}")
+        return [get_embeddings(image, model_name) for image in images]
+
+def enabled_models():
+    return [model_name for model_name, config in MODELS.items() if config["enabled"]]
+
+def run_models(task, model_names):
+    """Run task(model_name) for every model, concurrently when MODEL_EXECUTOR is "thread".
+    
+    Returns ({model_name: result}, {model_name: seconds}). Models that raise
+    are logged and left out, like the old sequential loops did.
+    """
+    def timed(model_name):
+        start = time.perf_counter()
+        result = task(model_name)
+        return result, time.perf_counter() - start
+    
+    if model_pool is not None:
+        futures = [(model_name, model_pool.submit(timed, model_name)) for model_name in model_names]
+        outcomes = [(model_name, future.result) for model_name, future in futures]
+    else:
+        outcomes = [(model_name, partial(timed, model_name)) for model_name in model_names]
+    
+    results, timings = {}, {}
+    for model_name, outcome in outcomes:
+        try:
+            results[model_name], timings[model_name] = outcome()
+        except Exception as e:
+            print(f"Error processing {model_name}: {str(e)}")
+    return results, timings
+
+def embed_face(face_img):
+    """Get the embeddings of one aligned face from every enabled model"""
+    embeddings, _ = run_models(lambda model_name: get_embeddings(face_img, model_name),
+                               enabled_models())
+    return {model_name: embedding for model_name, embedding in embeddings.items() if embedding}
+
+def score_faces(model_name, face_images, source, k=1, known=None):
+    """Embed faces with one model and search a gallery (a tenant's or a roster's).
+    
+    Returns one {"names", "distances", "embedding"} entry per face (nearest
+    first), or None where the face could not be embedded. known can hold a
+    {model_name: embedding} dict per face to skip embedding it again.
+    """
+    scores = [None] * len(face_images)
+    if len(source.get(model_name)[0]) == 0:
+        return scores
+    
+    # Embed every face not already embedded, then score them all at once
+    batch = [(known[i] if known else {}).get(model_name) for i in range(len(face_images))]
+    missing = [i for i, embedding in enumerate(batch) if not embedding]
+    if missing:
+        for i, embedding in zip(missing, get_embeddings_batch([face_images[i] for i in missing], model_name)):
+            batch[i] = embedding
+    embedded = [(i, embedding) for i, embedding in enumerate(batch) if embedding]
+    if not embedded:
+        return scores
+    
+    queries = normalize_rows([embedding for _, embedding in embedded])
+    names, distances = source.search(model_name, queries, k=k)
+    for row, (i, embedding) in enumerate(embedded):
+        scores[i] = {"names": names[row], "distances": distances[row], "embedding": embedding}
+    return scores
+
+def cascade_order():
+    """Enabled models in EARLY_EXIT["order"], followed by any enabled model it omits"""
+    enabled = enabled_models()
+    ordered = [model_name for model_name in EARLY_EXIT["order"] if model_name in enabled]
+    return ordered + [model_name for model_name in enabled if model_name not in ordered]
+
+def cascade_models(face_images, k, source, known=None):
+    """Run models one at a time, cheapest first, dropping each face once it is decided.
+    
+    A face is decided when EARLY_EXIT["quorum"] models agree on the same
+    name, or when a model's vote beats its runner-up by EARLY_EXIT["margin"]
+    cosine distance. Returns ({model_name: scores}, {model_name: seconds},
+    models run per face); faces a model skipped get a None score.
+    """
+    pending = list(range(len(face_images)))
+    counts = [{} for _ in face_images]
+    runs = [[] for _ in face_images]
+    model_scores, timings = {}, {}
+    
+    for model_name in cascade_order():
+        if not pending:
+            break
+        start = time.perf_counter()
+        try:
+            scores = score_faces(model_name, [face_images[i] for i in pending], source, k=max(k, 2),
+                                 known=[known[i] for i in pending] if known else None)
+        except Exception as e:
+            print(f"Error processing {model_name}: {str(e)}")
+            continue
+        timings[model_name] = time.perf_counter() - start
         
-        for model_name, config in MODELS.items():
-            if not config["enabled"]:
+        model_scores[model_name] = [None] * len(face_images)
+        still_pending = []
+        for i, score in zip(pending, scores):
+            runs[i].append(model_name)
+            model_scores[model_name][i] = score
+            if score is None:
+                still_pending.append(i)
                 continue
-                
-            try:
-                embedding = get_embeddings(face['face'], model_name)
-                if not embedding:
-                    continue
-                
-                best_name = "Unknown"
-                best_score = float('inf')
-                
-                for name, known_emb in known_faces[model_name]:
-                    score = cosine(embedding, known_emb)
-                    if score < best_score:
-                        best_score = score
-                        best_name = name
-                
-                confidence = 1 - best_score
-                if confidence > config["threshold"]:
-                    if best_name not in model_votes:
-                        model_votes[best_name] = {"count": 0, "total_conf": 0, "models": []}
-                    
-                    model_votes[best_name]["count"] += 1
-                    model_votes[best_name]["total_conf"] += confidence
-                    model_votes[best_name]["models"].append(model_name)
-                    
-            except Exception as e:
-                print(f"Error processing {model_name}: {str(e)}")
+            
+            distances = score["distances"]
+            if 1 - distances[0] <= MODELS[model_name]["threshold"]:
+                still_pending.append(i)
                 continue
-        
+            
+            name = score["names"][0]
+            counts[i][name] = counts[i].get(name, 0) + 1
+            margin = distances[1] - distances[0] if len(distances) > 1 else 0
+            if counts[i][name] < EARLY_EXIT["quorum"] and margin < EARLY_EXIT["margin"]:
+                still_pending.append(i)
+        pending = still_pending
+    
+    return model_scores, timings, runs
+
+def vote_faces(face_images, source, top_k=0, known=None):
+    """Score aligned faces against a gallery and vote across models.
+    
+    Returns (results, {model_name: seconds}); each result has "name",
+    "confidence", "models", "models_run", "embeddings" and, with top_k,
+    "candidates".
+    """
+    face_votes = [{} for _ in face_images]
+    face_candidates = [{} for _ in face_images]
+    
+    if EARLY_EXIT["enabled"]:
+        model_scores, timings, face_runs = cascade_models(face_images, max(top_k, 1), source,
+                                                          known=known)
+    else:
+        model_scores, timings = run_models(
+            lambda model_name: score_faces(model_name, face_images, source, k=max(top_k, 1),
+                                           known=known),
+            enabled_models())
+        face_runs = [list(model_scores) for _ in face_images]
+    
+    # Merge votes in a fixed model order so the outcome never depends on which model finished first
+    for model_name, scores in model_scores.items():
+        threshold = MODELS[model_name]["threshold"]
+        for i, score in enumerate(scores):
+            if score is None:
+                continue
+            best_name = score["names"][0]
+            confidence = float(1 - score["distances"][0])
+            
+            if top_k:
+                face_candidates[i][model_name] = [
+                    {"name": name, "confidence": float(1 - dist)}
+                    for name, dist in zip(score["names"][:top_k], score["distances"][:top_k])
+                ]
+            
+            if confidence > threshold:
+                model_votes = face_votes[i]
+                if best_name not in model_votes:
+                    model_votes[best_name] = {"count": 0, "total_conf": 0, "models": []}
+                
+                model_votes[best_name]["count"] += 1
+                model_votes[best_name]["total_conf"] += confidence
+                model_votes[best_name]["models"].append(model_name)
+    
+    face_embeddings = [
+        {model_name: scores[i]["embedding"] for model_name, scores in model_scores.items()
+         if scores[i] is not None}
+        for i in range(len(face_images))
+    ]
+    
+    results = []
+    for i, model_votes in enumerate(face_votes):
         if model_votes:
             # Enhanced voting: consider both count and average confidence
             best_match = max(model_votes.items(), 
@@ -277,21 +574,140 @@ def match_faces(image):
             results.append({
                 "name": best_match[0],
                 "confidence": avg_conf,
-                "bbox": face['area'],
-                "models": used_models,
-                "detection_confidence": face['confidence']
+                "models": used_models
             })
         else:
             results.append({
                 "name": "Unknown",
                 "confidence": 0,
-                "bbox": face['area'],
-                "models": "",
-                "detection_confidence": face['confidence']
+                "models": ""
             })
+        
+        # Keep embeddings passed in for models that did not run this time
+        embeddings = dict(known[i]) if known else {}
+        embeddings.update(face_embeddings[i])
+        results[-1]["models_run"] = face_runs[i]
+        results[-1]["embeddings"] = embeddings
+        if top_k:
+            results[-1]["candidates"] = face_candidates[i]
+    
+    return results, timings
+
+def match_faces(image, source, top_k=0, stats=None, fallback=None):
+    """Enhanced face matching with multiple models and voting system
+    
+    If a stats dict is passed it receives per-model wall-clock "timings".
+    Results also carry the aligned "face" crop and its per-model
+    "embeddings" so unknown faces can be registered without recomputing them.
+    Each result lists the models that actually ran on that face in
+    "models_run", which is shorter than the enabled set under EARLY_EXIT.
+    
+    source is the gallery searched: a tenant's Gallery or a roster's
+    SubGallery. Faces it leaves Unknown are searched again in the fallback
+    gallery, if one is given, reusing their embeddings. "scope" says which
+    kind of gallery matched a face.
+    """
+    faces = extract_faces(image)
+    
+    if not faces:
+        return []
+    
+    face_images = [face['face'] for face in faces]
+    votes, timings = vote_faces(face_images, source, top_k=top_k)
+    scope = "roster" if isinstance(source, SubGallery) else "global"
+    scopes = [scope] * len(faces)
+    
+    if fallback is not None:
+        unknown = [i for i, vote in enumerate(votes) if vote["name"] == "Unknown"]
+        if unknown:
+            retried, retry_timings = vote_faces([face_images[i] for i in unknown], fallback, top_k=top_k,
+                                                known=[votes[i]["embeddings"] for i in unknown])
+            for i, vote in zip(unknown, retried):
+                vote["models_run"] = votes[i]["models_run"] + [
+                    model_name for model_name in vote["models_run"] if model_name not in votes[i]["models_run"]]
+                votes[i] = vote
+                scopes[i] = "global"
+            for model_name, seconds in retry_timings.items():
+                timings[model_name] = timings.get(model_name, 0) + seconds
+    if stats is not None:
+        stats["timings"] = timings
+    
+    results = []
+    for face, vote, face_scope in zip(faces, votes, scopes):
+        vote["bbox"] = face['area']
+        vote["detection_confidence"] = face['confidence']
+        vote["face"] = face['face']
+        vote["scope"] = face_scope
+        results.append(vote)
     
     return results
 
+def cached_match_faces(image, top_k=0, stats=None, colid=None, roster=None, fallback=False):
+    """match_faces() behind an LRU keyed by a hash of the decoded pixels.
+    
+    The gallery version is part of the key, so a register or delete never
+    serves a stale result; gallery_changed() also drops the old entries.
+    Versions are unique per process, so they also tell tenants apart.
+    roster is an optional (field, value) pair from ROSTER_FIELDS.
+    """
+    gallery = galleries.get(colid)
+    gallery.refresh()
+    digest = hashlib.sha256(image.tobytes()).hexdigest()
+    key = (digest, image.shape, top_k, gallery.version, roster, fallback)
+    results = result_cache.get(key)
+    if results is not None:
+        if stats is not None:
+            stats["cached"] = True
+        return results
+    
+    source = rosters.get(gallery, *roster) if roster else gallery
+    results = match_faces(image, source, top_k=top_k, stats=stats,
+                          fallback=gallery if fallback and source is not gallery else None)
+    result_cache.put(key, results)
+    return results
+
+# Only the participant fields /api/identify returns
+PROFILE_PROJECTION = {
+    "_id": 0, "name": 1, "email": 1, "phone": 1, "registered_at": 1,
+    attendance.COUNT_FIELD: 1, attendance.LAST_SEEN_FIELD: 1,
+    "class": 1, "program": 1, "program_code": 1, "course": 1, "course_code": 1,
+    "attendance_percentage": 1
+}
+
+def get_profiles(names, gallery):
+    """Participant profiles by name for one tenant: cached ones, then the rest in one $in query"""
+    profiles = {}
+    missing = []
+    for name in set(names):
+        profile = profile_cache.get((gallery.version, name))
+        if profile is None:
+            missing.append(name)
+        else:
+            profiles[name] = profile
+    
+    if missing:
+        query = {"name": {"$in": missing}, **tenant_filter(gallery.colid)}
+        for doc in db.participants.find(query, PROFILE_PROJECTION):
+            profiles[doc["name"]] = doc
+            profile_cache.put((gallery.version, doc["name"]), doc)
+    return profiles
+
+def request_colid():
+    """Tenant of the current request: "colid" in the JSON body or query string, or an X-Colid header"""
+    data = request.get_json(silent=True) or {}
+    colid = data.get("colid") or request.args.get("colid") or request.headers.get("X-Colid")
+    return (str(colid).strip() or None) if colid else None
+
+def login_filter(colid):
+    """Students a login index covers; without a colid every student, as the login page sends none"""
+    return {"colid": colid} if colid else {}
+
+def gallery_changed():
+    """Drop everything derived from the gallery after a register or delete"""
+    result_cache.clear()
+    profile_cache.clear()
+    rosters.clear()
+
 def annotate_image(img, results):
     """Draw enhanced annotations on image"""
     for res in results:
@@ -315,11 +731,75 @@ def annotate_image(img, results):
 
 
 client = get_mongo_client()
-db = client["face_recognition_db"]
+db = client[DATABASE_NAME]
 fs = GridFS(db)
 
+# Per-event attendance statistics, updated by every mark and delete
+attendance_stats = AttendanceStats(db)
+
 # Add this line to access login collection
 users_collection = db["students"]
+encodings_collection = db["student_encodings"]
+
+# dlib encodings of the students for /login_face, one index per colid
+LOGIN_TOLERANCE = 0.45  # you can adjust this threshold
+
+LOGIN_POLL_INTERVAL = float(os.getenv("LOGIN_POLL", "5"))  # seconds between checks for new students
+
+def load_login_index(colid):
+    index = EncodingIndex(encodings_collection, query=login_filter(colid), poll_interval=LOGIN_POLL_INTERVAL)
+    index.load()
+    return index
+
+known_tenants = KnownTenants(db, ttl=TENANT_MEMORY["known_ttl"])
+
+@app.before_request
+def reject_unknown_colid():
+    """Refuse requests for colleges that do not exist before any tenant is loaded for them"""
+    if request.endpoint == "register_user":
+        return None  # registering a student is how a college comes into existence
+    colid = request_colid()
+    if colid not in known_tenants:
+        return jsonify({"error": f"Unknown colid: {colid}"}), 400
+
+login_indexes = TenantPool(load_login_index, TENANT_MEMORY["login_bytes"], name="login index",
+                           max_tenants=TENANT_MEMORY["max_tenants"])
+login_indexes.get(None)
+
+# Face embeddings: Mongo documents plus the in-memory index, one Gallery per
+# colid, changed only through gallery.add/replace/remove
+def load_gallery(colid):
+    tenant_dir = tenant_dirname(colid)
+    gallery = Gallery(db,
+                      GalleryIndex(db.face_embeddings,
+                                   ann=dict(ANN_CONFIG, index_dir=os.path.join(ANN_CONFIG["index_dir"], tenant_dir)),
+                                   snapshot_dir=(os.path.join(GALLERY_SNAPSHOT["dir"], tenant_dir)
+                                                 if GALLERY_SNAPSHOT["dir"] else None),
+                                   poll_interval=GALLERY_SNAPSHOT["poll_interval"],
+                                   publish_interval=GALLERY_SNAPSHOT["publish_interval"],
+                                   query=tenant_filter(colid)),
+                      model_version=EMBEDDING_VERSION,
+                      sync_poll_interval=GALLERY_SYNC["poll_interval"],
+                      change_stream=GALLERY_SYNC["change_stream"],
+                      colid=colid)
+    gallery.on_change(gallery_changed)
+    gallery.start()
+    return gallery
+
+def save_gallery_indexes():
+    for gallery in galleries.items():
+        gallery.save_indexes()
+
+galleries = TenantPool(load_gallery, TENANT_MEMORY["gallery_bytes"], name="gallery",
+                       max_tenants=TENANT_MEMORY["max_tenants"])
+galleries.get(None)
+rosters = RosterGalleries(db, maxsize=ROSTER_CACHE["max"], ttl=ROSTER_CACHE["ttl"])
+atexit.register(save_gallery_indexes)
+
+if MODEL_LOADING == "eager":
+    model_registry.load_all()
+elif MODEL_LOADING == "background":
+    model_registry.start_background()
 
 # Routes
 
@@ -330,8 +810,19 @@ def identify_faces():
         if not image_data.startswith('data:image'):
             return jsonify({"error": "Invalid image data"}), 400
 
+        top_k = int(request.json.get('top_k', 0))
+        # Optional roster: match only the participants of one event, class or course
+        roster = next(((field, str(request.json[field]).strip()) for field in ROSTER_FIELDS
+                       if str(request.json.get(field) or "").strip()), None)
+        fallback = bool(request.json.get('fallback', False))
+        colid = request_colid()
         img = base64_to_cv2(image_data)
-        results = match_faces(img)
+        start = time.perf_counter()
+        stats = {}
+        results = cached_match_faces(img, top_k=top_k, stats=stats, colid=colid,
+                                     roster=roster, fallback=fallback)
+        timings = {"models": stats.get("timings", {}), "total": time.perf_counter() - start,
+                   "cached": stats.get("cached", False)}
         
         if not results:
             return jsonify({"status": "no_faces"})
@@ -343,17 +834,20 @@ def identify_faces():
         # Get participant details for known faces
         people_data = []
         unknown_faces = []
+        profiles = get_profiles([res["name"] for res in results if res["name"] != "Unknown"],
+                                galleries.get(colid))
         
         for res in results:
             if res["name"] != "Unknown":
-                person = db.participants.find_one({"name": res["name"]})
+                person = profiles.get(res["name"])
                 if person:
                     people_data.append({
                         "name": res["name"],
                         "email": person.get("email", ""),
                         "phone": person.get("phone", ""),
                         "registered_on": person.get("registered_at", ""),
-                        "attendance": person.get("attendance", []),
+                        "attendance_count": person.get(attendance.COUNT_FIELD, 0),
+                        "last_seen": person.get(attendance.LAST_SEEN_FIELD),
                         "class": person.get("class", ""),
                         "program": person.get("program", ""),
                         "program_code": person.get("program_code", ""),
@@ -363,23 +857,40 @@ def identify_faces():
                         "confidence": float(res["confidence"]),
                         "bbox": res["bbox"],
                         "models": res["models"],
-                        "detection_confidence": res["detection_confidence"]
+                        "models_run": res["models_run"],
+                        "detection_confidence": res["detection_confidence"],
+                        "scope": res["scope"]
                     })
+                    if top_k:
+                        people_data[-1]["candidates"] = res["candidates"]
 
             else:
+                token = secrets.token_urlsafe(16)
+                face_tokens.put(token, {
+                    "colid": colid,
+                    "face": res["face"],
+                    "embeddings": res["embeddings"],
+                    "confidence": res["detection_confidence"]
+                })
                 unknown_faces.append({
                     "id": f"face_{len(unknown_faces) + 1}",
+                    "token": token,
                     "confidence": float(res["confidence"]),
                     "bbox": res["bbox"],
+                    "models_run": res["models_run"],
                     "detection_confidence": res["detection_confidence"]
                 })
+                if top_k:
+                    unknown_faces[-1]["candidates"] = res["candidates"]
 
         return jsonify({
             "status": "success",
             "known_faces": people_data,
             "unknown_faces": unknown_faces,
             "annotated_image": annotated_image,
-            "original_image": image_data  # Return original for comparison
+            "original_image": image_data,  # Return original for comparison
+            "timings": timings,
+            "roster": {"field": roster[0], "value": roster[1], "fallback": fallback} if roster else None
         })
 
     except ValueError as e:
@@ -388,6 +899,63 @@ def identify_faces():
         print("Error identifying face:", str(e))
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    """Report per-model and per-detector load state and warm-up latency"""
+    status = model_registry.status()
+    return jsonify({
+        "status": "ready" if status["ready"] else "starting",
+        "models": status["models"],
+        "detectors": status["detectors"]
+    }), 200 if status["ready"] else 503
+
+@app.route('/api/stats', methods=['GET'])
+def stats_totals():
+    """Attendance totals, read from counters maintained on every mark and delete"""
+    try:
+        return jsonify({"status": "success", "stats": attendance_stats.totals()})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/stats/events', methods=['GET'])
+def stats_events():
+    try:
+        return jsonify({"status": "success", "events": attendance_stats.events()})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/stats/events/<name>', methods=['GET'])
+def stats_event(name):
+    try:
+        events = attendance_stats.events({"_id": name})
+        if name not in events:
+            return jsonify({"error": "No attendance recorded for this event"}), 404
+        return jsonify({"status": "success", "event": name, "stats": events[name]})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/stats/participants/<name>', methods=['GET'])
+def stats_participant(name):
+    """A participant's counters and computed attendance_percentage"""
+    try:
+        stats = attendance_stats.participant({"name": name, **tenant_filter(request_colid())})
+        if stats is None:
+            return jsonify({"error": "Participant not found"}), 404
+        return jsonify({"status": "success", "stats": stats})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "status": "success",
+        "identify_results": result_cache.stats(),
+        "face_tokens": face_tokens.stats(),
+        "profiles": profile_cache.stats(),
+        "galleries": galleries.stats(),
+        "login_indexes": login_indexes.stats()
+    })
+
 @app.route('/api/events', methods=['GET'])
 def get_events():
     try:
@@ -412,7 +980,8 @@ def register_face():
             return jsonify({"error": "Invalid image data"}), 400
 
         # Check if name exists
-        if db.participants.count_documents({"name": name}) > 0:
+        colid = request_colid()
+        if db.participants.count_documents({"name": name, **tenant_filter(colid)}) > 0:
             return jsonify({"error": "Name already registered"}), 400
 
         # Process image
@@ -425,12 +994,7 @@ def register_face():
             return jsonify({"error": "Multiple faces detected. Please upload image with one clear face"}), 400
 
         # Generate embeddings for all enabled models
-        embeddings = {}
-        for model_name, config in MODELS.items():
-            if config["enabled"]:
-                embedding = get_embeddings(faces[0]['face'], model_name)
-                if embedding:
-                    embeddings[model_name] = embedding
+        embeddings = embed_face(faces[0]['face'])
 
         if not embeddings:
             return jsonify({"error": "Could not generate face embeddings"}), 400
@@ -444,8 +1008,7 @@ def register_face():
         participant = {
             "name": name,
             "image_id": str(file_id),
-            "registered_at": datetime.now(),
-            "attendance": []
+            "registered_at": datetime.now()
         }
         participant["email"] = data.get("email", "").strip()
         participant["phone"] = data.get("phone", "").strip()
@@ -465,12 +1028,9 @@ def register_face():
             participant['phone'] = data['phone'].strip()
 
         # Store in database
+        participant["colid"] = colid
         db.participants.insert_one(participant)
-        db.face_embeddings.insert_one({
-            "name": name,
-            "embeddings": embeddings,
-            "updated_at": datetime.now()
-        })
+        galleries.get(colid).add(name, embeddings)
 
         return jsonify({
             "status": "success",
@@ -490,33 +1050,45 @@ def register_unknown_face():
         name = data.get('name', '').strip()
         face_id = data.get('face_id', '')
         image_data = data.get('image', '')
+        token = data.get('token', '')
         
-        if not name or not face_id or not image_data:
-            return jsonify({"error": "Name, face ID and image are required"}), 400
-
-        # Process image
-        img = base64_to_cv2(image_data)
-        
-        # Find the face in the image
-        faces = extract_faces(img)
-        face_data = None
-        
-        # Simple face matching by position (for demo - in production use better matching)
-        for face in faces:
-            if f"face_{faces.index(face) + 1}" == face_id:
-                face_data = face
-                break
-        
-        if not face_data:
-            return jsonify({"error": "Face not found"}), 404
+        if not name or not (token or (face_id and image_data)):
+            return jsonify({"error": "Name and a face token, or face ID and image, are required"}), 400
+
+        # Reuse the crop and embeddings computed by /api/identify when possible
+        colid = request_colid()
+        face_data = face_tokens.get(token) if token else None
+        if face_data and face_data.get("colid") != colid:
+            return jsonify({"error": "Face token was issued to another college"}), 403
+        if face_data:
+            embeddings = dict(face_data['embeddings'])
+            for model_name in enabled_models():
+                if model_name not in embeddings:
+                    embedding = get_embeddings(face_data['face'], model_name)
+                    if embedding:
+                        embeddings[model_name] = embedding
+        else:
+            if not face_id or not image_data:
+                return jsonify({"error": "Face token expired; face ID and image are required"}), 400
+            
+            # Process image
+            img = base64_to_cv2(image_data)
+            
+            # Find the face in the image
+            faces = extract_faces(img)
+            face_data = None
+            
+            # Simple face matching by position (for demo - in production use better matching)
+            for face in faces:
+                if f"face_{faces.index(face) + 1}" == face_id:
+                    face_data = face
+                    break
+            
+            if not face_data:
+                return jsonify({"error": "Face not found"}), 404
 
-        # Generate embeddings
-        embeddings = {}
-        for model_name, config in MODELS.items():
-            if config["enabled"]:
-                embedding = get_embeddings(face_data['face'], model_name)
-                if embedding:
-                    embeddings[model_name] = embedding
+            # Generate embeddings
+            embeddings = embed_face(face_data['face'])
 
         if not embeddings:
             return jsonify({"error": "Could not generate face embeddings"}), 400
@@ -525,7 +1097,6 @@ def register_unknown_face():
         participant = {
             "name": name,
             "registered_at": datetime.now(),
-            "attendance": [],
             "email": data.get("email", "").strip(),
             "phone": data.get("phone", "").strip(),
             "class": data.get("class", "").strip(),
@@ -539,12 +1110,11 @@ def register_unknown_face():
             "attendance_percentage": data.get("attendance_percentage")
         }
 
+        participant["colid"] = colid
         db.participants.insert_one(participant)
-        db.face_embeddings.insert_one({
-            "name": name,
-            "embeddings": embeddings,
-            "updated_at": datetime.now()
-        })
+        galleries.get(colid).add(name, embeddings)
+        if token:
+            face_tokens.pop(token)
 
         return jsonify({
             "status": "success",
@@ -566,63 +1136,141 @@ def mark_attendance():
             return jsonify({"error": "Name and event are required"}), 400
 
         # Find participant
-        participant = db.participants.find_one({"name": name})
+        colid = request_colid()
+        participant = db.participants.find_one({"name": name, **tenant_filter(colid)}, {"_id": 1, "name": 1})
         if not participant:
             return jsonify({"error": "Participant not found"}), 404
 
-        # Check for existing attendance
-        existing = db.attendance.find_one({
-            "name": name,
-            "event": event,
-            "timestamp": {
-                "$gte": datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            }
-        })
-        
-        if existing:
+        # One upsert keyed on (participant_id, event, day); the unique index rejects duplicates
+        now = datetime.now()
+        if not attendance.mark(db, participant, event, now):
             return jsonify({
                 "status": "success",
                 "message": f"Attendance already marked for {name} at {event} today"
             })
+        attendance_stats.marked(event, attendance.attendance_day(now), 1, now)
+        profile_cache.pop((galleries.get(colid).version, name))
 
-        # Create attendance record
-        attendance_record = {
-            "name": name,
-            "event": event,
-            "timestamp": datetime.now(),
-            "participant_id": participant["_id"]
-        }
+        return jsonify({
+            "status": "success",
+            "message": f"Attendance marked for {name} at {event}"
+        })
 
-        db.attendance.insert_one(attendance_record)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/mark_attendance/bulk', methods=['POST'])
+def mark_attendance_bulk():
+    """Mark attendance for many names at one event.
+    
+    Resolves every participant with one $in query and upserts their records
+    with one unordered bulk_write; the (participant_id, event, day) unique
+    index decides who was already marked. Counters of the newly marked are
+    bumped with one more bulk_write. Returns a status per name:
+    "marked", "already_marked" or "unknown".
+    """
+    try:
+        data = request.json
+        event = data.get("event", "").strip()
+        names = list(dict.fromkeys(str(name).strip() for name in data.get("names", []) if str(name).strip()))
         
-        # Update participant's attendance record
-        db.participants.update_one(
-            {"_id": participant["_id"]},
-            {"$push": {"attendance": {
-                "event": event,
-                "timestamp": datetime.now()
-            }}}
-        )
+        if not event or not names:
+            return jsonify({"error": "Event and a list of names are required"}), 400
+
+        colid = request_colid()
+        participants = {doc["name"]: doc for doc in db.participants.find(
+            {"name": {"$in": names}, **tenant_filter(colid)}, {"_id": 1, "name": 1})}
+        
+        now = datetime.now()
+        marked = attendance.mark_many(db, [participants[name] for name in names if name in participants],
+                                      event, now)
+        statuses = {name: "already_marked" if name in participants else "unknown" for name in names}
+        for participant in marked:
+            statuses[participant["name"]] = "marked"
+
+        if marked:
+            attendance_stats.marked(event, attendance.attendance_day(now), len(marked), now)
+            version = galleries.get(colid).version
+            for participant in marked:
+                profile_cache.pop((version, participant["name"]))
 
         return jsonify({
             "status": "success",
-            "message": f"Attendance marked for {name} at {event}"
+            "event": event,
+            "results": [{"name": name, "status": statuses[name]} for name in names],
+            "marked": len(marked),
+            "already_marked": sum(status == "already_marked" for status in statuses.values()),
+            "unknown": sum(status == "unknown" for status in statuses.values())
         })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def encode_cursor(values):
+    """Opaque keyset pagination cursor for the sort key of the last row returned"""
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def decode_cursor(cursor, *types):
+    """Sort key values from encode_cursor(), each converted by the matching type"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(types):
+            raise ValueError(cursor)
+        return [convert(value) for convert, value in zip(types, values)]
+    except Exception:
+        raise ValueError("Invalid cursor")
+
 @app.route('/api/participants', methods=['GET'])
 def get_participants():
+    """List the participants of one college (colid) with their attendance.
+    
+    Only the request's colid is listed (see request_colid); without one,
+    the participants that have no colid. Query parameters: limit (page size, all participants if omitted),
+    cursor (next_cursor of the previous page) and counts_only=true to return
+    attendance_count without the attendance records. Counts come from the
+    participants' own counters; records from one grouped aggregation for
+    the whole page.
+    """
     try:
-        participants = []
-        for doc in db.participants.find({}, {
+        limit = int(request.args.get('limit', 0))
+        cursor = request.args.get('cursor', '')
+        counts_only = request.args.get('counts_only', 'false').lower() == 'true'
+        
+        query = tenant_filter(request_colid())
+        if cursor:
+            last_name, last_id = decode_cursor(cursor, str, ObjectId)
+            query = {"$and": [query, {"$or": [
+                {"name": {"$gt": last_name}},
+                {"name": last_name, "_id": {"$gt": last_id}}
+            ]}]}
+        
+        docs = db.participants.find(query, {
             "name": 1,
             "email": 1,
             "phone": 1,
             "registered_at": 1,
-            "image_id": 1
-        }):
+            "image_id": 1,
+            attendance.COUNT_FIELD: 1,
+            attendance.LAST_SEEN_FIELD: 1
+        }).sort([("name", 1), ("_id", 1)])
+        if limit:
+            docs = docs.limit(limit)
+        docs = list(docs)
+        
+        # 🔍 Attendance for the whole page in one grouped query, newest first.
+        # Keyed by participant_id: names are only unique within a colid
+        ids = [doc["_id"] for doc in docs]
+        attendance_by_id = {}
+        if ids and not counts_only:
+            attendance_by_id = {row["_id"]: row["attendance"] for row in db.attendance.aggregate([
+                {"$match": {"participant_id": {"$in": ids}}},
+                {"$sort": {"timestamp": -1}},
+                {"$group": {"_id": "$participant_id",
+                            "attendance": {"$push": {"event": "$event", "timestamp": "$timestamp"}}}}
+            ])}
+        
+        participants = []
+        for doc in docs:
             participant = {
                 "name": doc.get("name"),
                 "email": doc.get("email", ""),
@@ -634,30 +1282,35 @@ def get_participants():
             if "image_id" in doc:
                 participant["image"] = f"/image/{doc['image_id']}"
 
-            # 🔍 Dynamically fetch attendance from attendance collection
-            attendance = list(db.attendance.find(
-                {"name": doc.get("name")},
-                {"_id": 0, "event": 1, "timestamp": 1}
-            ).sort("timestamp", -1))
-
-            participant["attendance"] = attendance
+            participant["attendance_count"] = doc.get(attendance.COUNT_FIELD, 0)
+            participant["last_seen"] = doc.get(attendance.LAST_SEEN_FIELD)
+            if not counts_only:
+                participant["attendance"] = attendance_by_id.get(doc["_id"], [])
             participants.append(participant)
 
+        next_cursor = None
+        if limit and len(docs) == limit:
+            next_cursor = encode_cursor([docs[-1].get("name"), str(docs[-1]["_id"])])
+
         return jsonify({
             "status": "success",
             "participants": participants,
-            "count": len(participants)
+            "count": len(participants),
+            "next_cursor": next_cursor
         })
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/participants/<name>', methods=['DELETE'])
 def delete_participant(name):
     try:
-        result = db.participants.delete_one({"name": name})
+        colid = request_colid()
+        result = db.participants.delete_one({"name": name, **tenant_filter(colid)})
         if result.deleted_count == 1:
-            db.face_embeddings.delete_one({"name": name})
+            galleries.get(colid).remove(name)
             return jsonify({
                 "status": "success",
                 "message": f"Participant {name} deleted"
@@ -698,6 +1351,10 @@ def manage_events():
             faculty = data.get('faculty', '').strip()
             facultyid = data.get('facultyid', '').strip()
             period = data.get('period', '').strip()
+            # Optional expected participants, used by roster-scoped /api/identify
+            participants = [name.strip() for name in data.get('participants', []) if name.strip()]
+            event_class = data.get('class', '').strip()
+            course_code = data.get('course_code', '').strip()
 
             if not event_name or not event_date or not event_time or not location:
                 return jsonify({"error": "Missing required fields"}), 400
@@ -713,6 +1370,9 @@ def manage_events():
                 "faculty": faculty,
                 "facultyid": facultyid,
                 "period": period,
+                "participants": participants,
+                "class": event_class,
+                "course_code": course_code,
                 "created_at": datetime.now()
             })
             
@@ -728,6 +1388,7 @@ def delete_event(name):
     try:
         result = db.events.delete_one({"name": name})
         if result.deleted_count == 1:
+            rosters.clear()
             return jsonify({
                 "status": "success",
                 "message": "Event deleted successfully"
@@ -737,11 +1398,52 @@ def delete_event(name):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+ATTENDANCE_EXPORT_FIELDS = ("_id", "name", "event", "timestamp")
+ATTENDANCE_EXPORT_BATCH = int(os.getenv("ATTENDANCE_EXPORT_BATCH", 1000))
+
+def attendance_row(record):
+    """JSON-ready attendance record"""
+    record['_id'] = str(record['_id'])  # convert ObjectId to string
+    if isinstance(record.get('timestamp'), datetime):
+        record['timestamp'] = record['timestamp'].isoformat()
+    return record
+
+def stream_attendance(records, fmt):
+    """NDJSON or CSV export in ~64 KB chunks, so memory stays flat however many rows match"""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(ATTENDANCE_EXPORT_FIELDS)
+    for record in records:
+        row = attendance_row(record)
+        if fmt == 'csv':
+            writer.writerow([row.get(field, '') for field in ATTENDANCE_EXPORT_FIELDS])
+        else:
+            buffer.write(json.dumps(row) + "\n")
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
 @app.route('/api/attendance', methods=['GET'])
 def get_attendance():
+    """List attendance records, newest first.
+    
+    Query parameters: event and date (YYYY-MM-DD) filters, limit (page size,
+    all records if omitted) and cursor (next_cursor of the previous page),
+    paged on (timestamp, _id). format=ndjson or format=csv streams every
+    matching record instead of returning one JSON document.
+    """
     try:
         event = request.args.get('event', '')
         date = request.args.get('date', '')
+        limit = int(request.args.get('limit', 0))
+        cursor = request.args.get('cursor', '')
+        fmt = request.args.get('format', 'json').lower()
+        if fmt not in ('json', 'ndjson', 'csv'):
+            return jsonify({"error": f"Unsupported format: {fmt}"}), 400
         
         query = {}
         if event:
@@ -751,51 +1453,64 @@ def get_attendance():
                 "$gte": datetime.strptime(date, "%Y-%m-%d"),
                 "$lt": datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)
             }
+        if cursor:
+            last_timestamp, last_id = decode_cursor(cursor, datetime.fromisoformat, ObjectId)
+            query = {"$and": [query, {"$or": [
+                {"timestamp": {"$lt": last_timestamp}},
+                {"timestamp": last_timestamp, "_id": {"$lt": last_id}}
+            ]}]}
         
         attendance_cursor = db.attendance.find(query, {
             "name": 1,
             "event": 1,
             "timestamp": 1,
             "_id": 1
-        }).sort("timestamp", -1)
-
-        attendance = []
+        }).sort([("timestamp", -1), ("_id", -1)])
+        if limit:
+            attendance_cursor = attendance_cursor.limit(limit)
+
+        if fmt != 'json':
+            # 📤 Streamed straight from the MongoDB cursor, never held in memory
+            attendance_cursor = attendance_cursor.batch_size(ATTENDANCE_EXPORT_BATCH)
+            extension, mimetype = ('csv', 'text/csv') if fmt == 'csv' else ('ndjson', 'application/x-ndjson')
+            return Response(stream_attendance(attendance_cursor, fmt), mimetype=mimetype, headers={
+                "Content-Disposition": f"attachment; filename=attendance.{extension}"
+            })
 
+        attendance_records = []
+        next_cursor = None
         for record in attendance_cursor:
+            if limit and len(attendance_records) == limit - 1:
+                next_cursor = encode_cursor([record['timestamp'].isoformat(), str(record['_id'])])
             record['_id'] = str(record['_id'])  # convert ObjectId to string
-            attendance.append(record)
+            attendance_records.append(record)
         
         return jsonify({
             "status": "success",
-            "attendance": attendance,
-            "count": len(attendance)
+            "attendance": attendance_records,
+            "count": len(attendance_records),
+            "next_cursor": next_cursor
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/attendance/<id>', methods=['DELETE'])
 def delete_attendance_record(id):
     try:
-        # First get the record to update participant's attendance
-        record = db.attendance.find_one({"_id": ObjectId(id)})
-        if not record:
+        # Delete the record and take it off the participant's counters
+        record = attendance.unmark(db, ObjectId(id))
+        if record is None:
             return jsonify({"error": "Attendance record not found"}), 404
+        attendance_stats.unmarked(record["event"],
+                                  record.get("day") or attendance.attendance_day(record["timestamp"]))
+        profile_cache.clear()
         
-        # Delete from attendance collection
-        result = db.attendance.delete_one({"_id": ObjectId(id)})
-        if result.deleted_count == 1:
-            # Remove from participant's attendance array
-            db.participants.update_one(
-                {"name": record["name"]},
-                {"$pull": {"attendance": {"event": record["event"], "timestamp": record["timestamp"]}}}
-            )
-            
-            return jsonify({
-                "status": "success",
-                "message": "Attendance record deleted"
-            })
-        else:
-            return jsonify({"error": "Attendance record not found"}), 404
+        return jsonify({
+            "status": "success",
+            "message": "Attendance record deleted"
+        })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -872,12 +1587,23 @@ def register_user():
         "colid": data.get("colid"), 
         "status": data["status"],
         "status1": data["status1"],
-        "photo": image_data,          # Optional: keep base64 for preview
-        "face_encoding": encoding_list,  # IMPORTANT: store encoding here
         "created_at": datetime.utcnow().isoformat()
     }
 
-    users_collection.insert_one(user_data)
+    # Keep the student document small: the photo goes to GridFS and the
+    # encoding to its own collection, both keyed back to the student
+    content_type = header.split(":", 1)[-1].split(";", 1)[0] or "image/jpeg"
+    user_data["photo_id"] = fs.put(decoded, filename=data["name"], content_type=content_type)
+
+    result = users_collection.insert_one(user_data)
+    known_tenants.add(user_data["colid"])
+    encodings_collection.insert_one({"_id": result.inserted_id, "colid": user_data["colid"],
+                                     "face_encoding": encoding_list})
+    # Only indexes already in memory need the new row; others load it from Mongo
+    for colid in {user_data["colid"] or None, None}:
+        login_index = login_indexes.peek(colid)
+        if login_index is not None:
+            login_index.add(result.inserted_id, encoding_list)
 
     return jsonify({"message": "User registered successfully"}), 201
 
@@ -904,20 +1630,17 @@ def login_face():
 
         captured_encoding = face_encodings[0]
 
-        # Check against all stored encodings
-        for user in users_collection.find():
-            stored_encoding = user.get("face_encoding")
-            if not stored_encoding:
-                continue
-
-            match = face_recognition.compare_faces(
-                [np.array(stored_encoding)],
-                captured_encoding,
-                tolerance=0.45  # you can adjust this threshold
-            )
-
-            if match[0]:
+        # Closest stored encoding among the college's users in one vectorised call
+        login_index = login_indexes.get(request_colid())
+        login_index.refresh()  # students registered through other workers
+        user_id, _ = login_index.match(captured_encoding, tolerance=LOGIN_TOLERANCE)
+        if user_id is not None:
+            user = users_collection.find_one({"_id": user_id}, {"face_encoding": 0})
+            if user:
                 user["_id"] = str(user["_id"])
+                if user.get("photo_id"):
+                    user["photo_id"] = str(user["photo_id"])
+                    user["photo"] = f"/image/{user['photo_id']}"
                 return jsonify(user), 200
 
         return jsonify({"error": "No matching user found"}), 404
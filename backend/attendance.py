@@ -0,0 +1,103 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+DAY_FORMAT = "%Y-%m-%d"
+DUPLICATE_KEY = 11000
+
+# Participant counters that replace the embedded attendance array
+COUNT_FIELD = "attendance_count"
+EVENTS_FIELD = "attendance_events"
+LAST_SEEN_FIELD = "last_seen"
+
+
+def attendance_day(timestamp):
+    """The "day" an attendance record counts for, as stored in attendance.day"""
+    return timestamp.strftime(DAY_FORMAT)
+
+
+def event_key(event):
+    """Event name usable as a field under attendance_events ("." and a leading "$" are not)"""
+    key = event.replace(".", "\uff0e")
+    return "\uff04" + key[1:] if key.startswith("$") else key
+
+
+def counter_update(event, step, now=None):
+    """$inc (and $max last_seen) for one attendance record added (step=1) or removed (step=-1)"""
+    update = {"$inc": {COUNT_FIELD: step, f"{EVENTS_FIELD}.{event_key(event)}": step}}
+    if now is not None:
+        update["$max"] = {LAST_SEEN_FIELD: now}
+    return update
+
+
+def ensure_indexes(db):
+    """One record per participant, event and day, enforced by MongoDB.
+
+    Partial, so legacy records without participant_id or day (see
+    'python migrations.py attendance_day') never block the build.
+    """
+    db.attendance.create_index(
+        [("participant_id", 1), ("event", 1), ("day", 1)],
+        unique=True,
+        partialFilterExpression={"participant_id": {"$exists": True}, "day": {"$exists": True}}
+    )
+
+
+def _upsert(participant, event, now):
+    """(filter, update) that inserts a record unless the day's one exists"""
+    return (
+        {"participant_id": participant["_id"], "event": event, "day": attendance_day(now)},
+        {"$setOnInsert": {"name": participant["name"], "timestamp": now}}
+    )
+
+
+def mark(db, participant, event, now):
+    """Record attendance and bump the participant's counters.
+
+    Returns False, writing nothing else, if it was already marked that day.
+    """
+    try:
+        result = db.attendance.update_one(*_upsert(participant, event, now), upsert=True)
+    except DuplicateKeyError:
+        return False  # a concurrent mark of the same participant won the insert
+    if result.upserted_id is None:
+        return False
+    db.participants.update_one({"_id": participant["_id"]}, counter_update(event, 1, now))
+    return True
+
+
+def mark_many(db, participants, event, now):
+    """Upsert one record per participant with a single unordered bulk_write.
+
+    Returns the participants whose record was newly inserted, after bumping
+    their counters with a second bulk_write; everyone else was already
+    marked that day.
+    """
+    if not participants:
+        return []
+    try:
+        requests = [UpdateOne(*_upsert(participant, event, now), upsert=True) for participant in participants]
+        upserted = db.attendance.bulk_write(requests, ordered=False).upserted_ids
+    except BulkWriteError as e:
+        if any(error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+            raise
+        upserted = {entry["index"]: entry["_id"] for entry in e.details.get("upserted", [])}
+
+    marked = [participants[index] for index in sorted(upserted)]
+    if marked:
+        db.participants.bulk_write([UpdateOne({"_id": participant["_id"]}, counter_update(event, 1, now))
+                                    for participant in marked], ordered=False)
+    return marked
+
+
+def unmark(db, record_id):
+    """Delete one attendance record and take it off its participant's counters.
+
+    Returns the deleted record, or None if there was none.
+    """
+    record = db.attendance.find_one_and_delete({"_id": record_id})
+    if record is None:
+        return None
+    participant = ({"_id": record["participant_id"]} if record.get("participant_id")
+                   else {"name": record["name"]})
+    db.participants.update_one(participant, counter_update(record["event"], -1))
+    return record
@@ -0,0 +1,67 @@
+"""Measure HNSW recall and latency against exact search on synthetic embeddings.
+
+Use it to pick HNSW_M / HNSW_EF_CONSTRUCTION / HNSW_EF_SEARCH for a
+deployment, e.g.:
+
+    python bench_ann.py --size 100000 --dim 512 --M 16 32 --ef-search 32 64 128 256
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import HNSWIndex
+from matching import normalize_rows, search
+
+
+def synthetic_gallery(rng, size, dim, queries, noise):
+    gallery = normalize_rows(rng.standard_normal((size, dim)).astype(np.float32))
+    picks = rng.integers(0, size, queries)
+    probes = normalize_rows(gallery[picks] + noise * rng.standard_normal((queries, dim)).astype(np.float32))
+    return gallery, probes
+
+
+def run(size, dim, queries, k, noise, Ms, ef_constructions, ef_searches, seed):
+    rng = np.random.default_rng(seed)
+    gallery, probes = synthetic_gallery(rng, size, dim, queries, noise)
+    names = [str(i) for i in range(size)]
+
+    start = time.perf_counter()
+    exact, _ = search(probes, gallery, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / queries
+    print(f"exact search: {exact_ms:.3f} ms/query over {size} x {dim}")
+    print(f"{'M':>4} {'ef_constr':>9} {'build (s)':>10} {'ef_search':>9} {'recall@' + str(k):>9} {'ms/query':>9}")
+
+    for M in Ms:
+        for ef_construction in ef_constructions:
+            index = HNSWIndex(dim, M=M, ef_construction=ef_construction, capacity=size)
+            start = time.perf_counter()
+            index.add(names, gallery)
+            build = time.perf_counter() - start
+
+            for ef_search in ef_searches:
+                index.set_ef(ef_search)
+                start = time.perf_counter()
+                found, _ = index.search(probes, k)
+                latency = (time.perf_counter() - start) * 1000 / queries
+
+                hits = sum(len(set(found[i].astype(int)) & set(exact[i])) for i in range(queries))
+                recall = hits / (queries * k)
+                print(f"{M:>4} {ef_construction:>9} {build:>10.2f} {ef_search:>9} {recall:>9.4f} {latency:>9.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--noise", type=float, default=0.5,
+                        help="std-dev of the perturbation between probe and enrolled embedding")
+    parser.add_argument("--M", type=int, nargs="+", default=[16])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[200])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.size, args.dim, args.queries, args.k, args.noise,
+        args.M, args.ef_construction, args.ef_search, args.seed)
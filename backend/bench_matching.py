@@ -0,0 +1,66 @@
+"""Benchmark gallery matching on synthetic embeddings.
+
+Compares the old per-identity scipy cosine loop with the vectorised
+matching.search() for galleries of 1k/10k/100k identities:
+
+    python bench_matching.py --sizes 1000 10000 100000 --faces 30
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy.spatial.distance import cosine
+
+from matching import normalize_rows, search
+
+
+def scipy_loop(queries, names, gallery):
+    """The original match_faces() inner loop"""
+    matches = []
+    for embedding in queries:
+        best_name = "Unknown"
+        best_score = float('inf')
+        for name, known_emb in zip(names, gallery):
+            score = cosine(embedding, known_emb)
+            if score < best_score:
+                best_score = score
+                best_name = name
+        matches.append((best_name, best_score))
+    return matches
+
+
+def run(sizes, faces, dim, loop_limit, seed):
+    rng = np.random.default_rng(seed)
+    print(f"{'identities':>10} {'scipy loop (s)':>15} {'vectorised (s)':>15} {'speedup':>9}")
+
+    for size in sizes:
+        raw = rng.standard_normal((size, dim)).astype(np.float32)
+        names = np.array([f"person_{i}" for i in range(size)], dtype=object)
+        queries = raw[rng.integers(0, size, faces)] + 0.1 * rng.standard_normal((faces, dim)).astype(np.float32)
+
+        gallery = normalize_rows(raw)
+        start = time.perf_counter()
+        indices, distances = search(normalize_rows(queries), gallery)
+        vector_time = time.perf_counter() - start
+
+        if size <= loop_limit:
+            start = time.perf_counter()
+            expected = scipy_loop(queries, names, raw)
+            loop_time = time.perf_counter() - start
+            for (name, score), idx, dist in zip(expected, indices[:, 0], distances[:, 0]):
+                assert name == names[idx] and abs(score - dist) < 1e-4, "vectorised result differs"
+            print(f"{size:>10} {loop_time:>15.4f} {vector_time:>15.4f} {loop_time / vector_time:>8.0f}x")
+        else:
+            print(f"{size:>10} {'skipped':>15} {vector_time:>15.4f} {'-':>9}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--faces", type=int, default=30, help="detected faces per photo")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--loop-limit", type=int, default=100000,
+                        help="skip the scipy loop above this gallery size")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.sizes, args.faces, args.dim, args.loop_limit, args.seed)
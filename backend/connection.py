@@ -0,0 +1,36 @@
+import os
+from urllib.parse import quote_plus
+
+from pymongo import MongoClient
+from pymongo.server_api import ServerApi
+
+DATABASE_NAME = "face_recognition_db"
+
+
+# MongoDB Atlas Connection
+def get_mongo_client():
+    try:
+        username = quote_plus(os.getenv("MONGO_USERNAME", "campustechnology"))
+        password = quote_plus(os.getenv("MONGO_PASSWORD", ""))
+        cluster_url = os.getenv("MONGO_CLUSTER", "cluster0.ns6jg36.mongodb.net")
+        
+        if not password:
+            raise ValueError("MongoDB password not configured")
+
+        uri = f"mongodb+srv://{username}:{password}@{cluster_url}/?retryWrites=true&w=majority&appName=Cluster0"
+        
+        client = MongoClient(
+            uri,
+            server_api=ServerApi('1'),
+            connectTimeoutMS=5000,
+            socketTimeoutMS=30000,
+            serverSelectionTimeoutMS=5000
+        )
+        
+        client.admin.command('ping')
+        print("Successfully connected to MongoDB Atlas!")
+        return client
+        
+    except Exception as e:
+        print(f"Failed to connect to MongoDB: {str(e)}")
+        raise
@@ -0,0 +1,55 @@
+import numpy as np
+from bson.binary import Binary
+
+EMBEDDING_DTYPE = "float32"
+
+
+def pack_embedding(embedding, model_version=None):
+    """Store one embedding as a float32 Binary blob with its dim/dtype/version"""
+    vector = np.asarray(embedding, dtype=EMBEDDING_DTYPE).ravel()
+    return {
+        "data": Binary(vector.tobytes()),
+        "dim": int(vector.shape[0]),
+        "dtype": EMBEDDING_DTYPE,
+        "model_version": model_version
+    }
+
+
+def pack_embeddings(embeddings, model_version=None):
+    """Pack a {model_name: vector} dict for db.face_embeddings"""
+    return {model_name: pack_embedding(embedding, model_version)
+            for model_name, embedding in embeddings.items()}
+
+
+def is_packed(value):
+    return isinstance(value, dict) and "data" in value
+
+
+def embedding_bytes(value):
+    """Raw float32 bytes of a stored embedding, packed or legacy BSON array"""
+    if is_packed(value):
+        if value.get("dtype", EMBEDDING_DTYPE) == EMBEDDING_DTYPE:
+            return bytes(value["data"])
+        return np.frombuffer(value["data"], dtype=value["dtype"]).astype(EMBEDDING_DTYPE).tobytes()
+    return np.asarray(value, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def unpack_embedding(value):
+    """Decode a stored embedding (packed or legacy) to a float32 vector"""
+    return np.frombuffer(embedding_bytes(value), dtype=EMBEDDING_DTYPE)
+
+
+def stack_embeddings(values):
+    """Decode many stored embeddings of one model into an (n, dim) float32 matrix.
+
+    Returns (matrix, kept) where kept marks the values whose dimension matched
+    the first one; anything else is skipped rather than corrupting the matrix.
+    """
+    chunks = [embedding_bytes(value) for value in values]
+    if not chunks:
+        return np.empty((0, 0), dtype=EMBEDDING_DTYPE), []
+    size = len(chunks[0])
+    kept = [len(chunk) == size for chunk in chunks]
+    matrix = np.frombuffer(b"".join(chunk for chunk, keep in zip(chunks, kept) if keep),
+                           dtype=EMBEDDING_DTYPE)
+    return matrix.reshape(-1, size // np.dtype(EMBEDDING_DTYPE).itemsize), kept
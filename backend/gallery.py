@@ -0,0 +1,544 @@
+import itertools
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+import numpy as np
+
+from ann_index import HNSWIndex, hnswlib
+from embedding_codec import pack_embeddings, stack_embeddings, unpack_embedding
+from gallery_sync import GallerySync
+from matching import normalize_rows, search
+from snapshot import current_generation, open_snapshot, publish_snapshot, snapshot_lock, snapshot_meta
+from tenants import tenant_filter
+
+MIN_CAPACITY = 64
+# Largest per-component difference between an indexed and a gallery vector still treated as equal
+VECTOR_TOLERANCE = 1e-4
+
+# Versions are unique across every GalleryIndex in the process, so caches keyed
+# by version never confuse a tenant's reloaded gallery with its evicted one
+_versions = itertools.count(1)
+
+
+class _ModelRows:
+    """One model's rows: a preallocated (capacity, dim) buffer, its names and a name -> row map.
+
+    Rows [0, count) are in use. Adding writes the next free slot and doubles
+    the buffer when it is full; removing moves the last row into the hole.
+    The buffer may be a read-only snapshot mapping, which is copied into a
+    private buffer the first time it is written.
+    """
+
+    def __init__(self, matrix, names):
+        self.matrix = matrix
+        self.names = names
+        self.count = len(names)
+        self.rows = {name: row for row, name in enumerate(names)}
+        self.lock = threading.Lock()  # held by searches reading the buffer in place
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def view(self):
+        return self.names[:self.count], self.matrix[:self.count]
+
+    def nbytes(self):
+        return self.matrix.nbytes + self.names.nbytes
+
+    def _reserve(self):
+        if self.matrix.flags.writeable and self.count < len(self.matrix):
+            return
+        capacity = max(MIN_CAPACITY, 2 * self.count)
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        names = np.empty(capacity, dtype=object)
+        matrix[:self.count] = self.matrix[:self.count]
+        names[:self.count] = self.names[:self.count]
+        self.matrix, self.names = matrix, names
+
+    def put(self, name, row):
+        with self.lock:
+            self._reserve()
+            position = self.rows.get(name)
+            if position is None:
+                position = self.count
+                self.rows[name] = position
+                self.names[position] = name
+                self.count += 1
+            self.matrix[position] = row
+
+    def remove(self, name):
+        if name not in self.rows:
+            return False
+        with self.lock:
+            self._reserve()
+            position = self.rows.pop(name)
+            last = self.count - 1
+            if position != last:
+                self.matrix[position] = self.matrix[last]
+                self.names[position] = self.names[last]
+                self.rows[self.names[position]] = position
+            self.names[last] = None
+            self.count = last
+        return True
+
+
+class GalleryIndex:
+    """Process-wide in-memory copy of db.face_embeddings.
+
+    Holds one float32 matrix per model plus the matching array of names, so
+    identification never has to scan MongoDB for embeddings. Rows are stored
+    L2-normalised, ready for cosine scoring with matching.search(). A single
+    register or delete updates one row in place (see _ModelRows) instead of
+    copying the whole gallery.
+
+    With ann={"backend": "hnsw", ...} each model also gets an HNSWIndex that
+    is kept in sync incrementally and answers searches once the gallery has
+    at least ann["min_size"] identities; smaller galleries stay exact.
+
+    With a snapshot_dir the matrices are published as .npy files and opened
+    with np.memmap, so every gunicorn worker shares one copy through the page
+    cache. Each publish is a new generation; refresh() swaps a worker to a
+    generation another worker published. Publishing rewrites the whole
+    gallery, so registers and deletes only mark the snapshot stale and it is
+    republished at most every publish_interval seconds (and by flush());
+    until then the changed rows live in a private copy and other workers
+    get them from the change log.
+
+    query limits the documents loaded, e.g. to one tenant (see tenants.py).
+    """
+
+    def __init__(self, collection, ann=None, snapshot_dir=None, poll_interval=1.0, query=None,
+                 publish_interval=30.0):
+        self.collection = collection
+        self.query = query or {}
+        self.ann = ann or {"backend": "exact"}
+        self.snapshot_dir = snapshot_dir
+        self.poll_interval = poll_interval
+        self.publish_interval = publish_interval
+        self._lock = threading.RLock()
+        self._models = {}
+        self._indexes = {}
+        self._generation = 0
+        self._next_poll = 0
+        self._dirty = False  # changes applied since the last publish
+        self._next_publish = 0
+        self.version = next(_versions)
+        self.sync_version = 0  # last change-log entry (gallery_sync) reflected here
+        # change_log(since, until) -> names changed by those entries, or None if unknown
+        self.change_log = None
+
+        if self.ann["backend"] == "hnsw" and hnswlib is None:
+            print("hnswlib is not installed, falling back to exact search")
+            self.ann = {"backend": "exact"}
+
+    def load(self, sync_version=0):
+        """Load every stored embedding in a single collection scan
+
+        Packed float32 blobs are joined and decoded with one np.frombuffer
+        per model; legacy BSON arrays are converted on the way. sync_version
+        is the change-log version read before the scan started.
+        """
+        rows = {}
+        for doc in self.collection.find(self.query, {"name": 1, "embeddings": 1}):
+            for model_name, embedding in doc.get("embeddings", {}).items():
+                rows.setdefault(model_name, []).append((doc["name"], embedding))
+
+        matrices = {}
+        names = {}
+        for model_name, entries in rows.items():
+            matrix, kept = stack_embeddings([emb for _, emb in entries])
+            names[model_name] = np.array([name for (name, _), keep in zip(entries, kept) if keep],
+                                         dtype=object)
+            matrices[model_name] = normalize_rows(matrix)
+
+        # An empty tenant publishes nothing (and creates no directory) until something is enrolled
+        with self._lock, (self._snapshot_lock() if names else nullcontext()):
+            self._set_all(matrices, names)
+            self.sync_version = sync_version
+            self._dirty = bool(self.snapshot_dir and names)
+            self._publish_if_due(force=True)
+            if self.snapshot_dir and not names:
+                # Generations already on disk predate this load; only newer ones are picked up
+                self._generation = current_generation(self.snapshot_dir)
+            self.version = next(_versions)
+            if self.ann["backend"] == "hnsw":
+                self._sync_indexes(from_disk=True)
+
+        print(f"Loaded gallery with {len(self)} identities")
+
+    def _set_all(self, matrices, names):
+        # Searches holding an old _ModelRows keep reading a consistent copy
+        self._models = {model_name: _ModelRows(matrices[model_name], names[model_name])
+                        for model_name in names}
+
+    def _snapshot_lock(self):
+        return snapshot_lock(self.snapshot_dir) if self.snapshot_dir else nullcontext()
+
+    def _publish(self):
+        """Write the current matrices as a new snapshot generation and map it back"""
+        if not self.snapshot_dir:
+            return
+        try:
+            views = {model_name: rows.view() for model_name, rows in self._models.items()}
+            generation = publish_snapshot(self.snapshot_dir,
+                                          {model_name: view[1] for model_name, view in views.items()},
+                                          {model_name: view[0] for model_name, view in views.items()},
+                                          meta={"sync_version": self.sync_version})
+            matrices, names, _ = open_snapshot(self.snapshot_dir, generation)
+            self._set_all(matrices, names)
+            self._generation = generation
+            self._dirty = False
+        except Exception as e:
+            print(f"Could not publish gallery snapshot: {str(e)}")
+        self._next_publish = time.monotonic() + self.publish_interval
+
+    def _publish_if_due(self, force=False):
+        """Publish changes applied since the last snapshot once publish_interval has passed (lock held)"""
+        if self._dirty and self.snapshot_dir and (force or time.monotonic() >= self._next_publish):
+            self._publish()
+
+    def flush(self):
+        """Publish any changes not yet in the shared snapshot"""
+        if not self._dirty:
+            return
+        with self._lock, self._snapshot_lock():
+            self._swap_to_latest()
+            self._publish_if_due(force=True)
+
+    def _swap_to_latest(self):
+        """Map the newest published generation if it is newer than ours (lock held)"""
+        generation = current_generation(self.snapshot_dir)
+        if generation <= self._generation:
+            return False
+        try:
+            if snapshot_meta(self.snapshot_dir, generation).get("sync_version", 0) < self.sync_version:
+                # Older than the changes applied here but not yet published; keep ours
+                self._generation = generation
+                return False
+            matrices, names, meta = open_snapshot(self.snapshot_dir, generation)
+        except Exception as e:
+            print(f"Could not open gallery snapshot {generation}: {str(e)}")
+            return False
+        self._set_all(matrices, names)
+        self._generation = generation
+        self._dirty = False
+        since = self.sync_version
+        self.sync_version = max(self.sync_version, meta.get("sync_version", 0))
+        self.version = next(_versions)
+        if self.ann["backend"] == "hnsw":
+            self._sync_indexes(since=since)
+        return True
+
+    def refresh(self):
+        """Pick up a snapshot published by another worker; polls at most every poll_interval"""
+        if not self.snapshot_dir:
+            return False
+        now = time.monotonic()
+        if now < self._next_poll:
+            return False
+        self._next_poll = now + self.poll_interval
+        if self._dirty and now >= self._next_publish:
+            self.flush()
+            return False
+        if current_generation(self.snapshot_dir) <= self._generation:
+            return False
+        with self._lock:
+            return self._swap_to_latest()
+
+    def _index_path(self, model_name):
+        return os.path.join(self.ann["index_dir"], model_name)
+
+    def _new_index(self, dim, capacity=1024):
+        return HNSWIndex(dim, M=self.ann["M"], ef_construction=self.ann["ef_construction"],
+                         ef_search=self.ann["ef_search"], capacity=capacity)
+
+    def _sync_indexes(self, from_disk=False, since=None):
+        """Reconcile every ANN index with the current matrices.
+
+        With from_disk, persisted indexes are reopened first; otherwise the
+        in-memory indexes are only patched with the identities that changed.
+        since is the sync_version the indexes were last in step with: names
+        the change log shows as changed after it are re-added even when
+        still present, because a name another worker removed and re-added
+        keeps its name but not its vector (and sync will not replay it).
+        Without a usable log every vector is compared instead.
+        """
+        for model_name, model_rows in self._models.items():
+            names, matrix = model_rows.view()
+            path = self._index_path(model_name)
+            index = self._indexes.get(model_name)
+            index_version = since
+            if from_disk:
+                index = HNSWIndex.load(path, ef_search=self.ann["ef_search"])
+                index_version = index.sync_version if index is not None else None
+            if index is None or index.dim != matrix.shape[1]:
+                index = self._new_index(matrix.shape[1], capacity=max(len(names), 1024))
+                index_version = self.sync_version
+
+            current = set(names)
+            for stale in index.names() - current:
+                index.remove(stale)
+            indexed = index.names()
+            changed = current - indexed
+
+            logged = None
+            if index_version is not None and self.change_log is not None:
+                logged = self.change_log(index_version, self.sync_version)
+            if logged is not None:
+                changed |= logged & indexed & current
+            else:
+                shared = np.array([name in indexed for name in names], dtype=bool)
+                if shared.any():
+                    drift = ~np.isclose(index.vectors(list(names[shared])), matrix[shared],
+                                        atol=VECTOR_TOLERANCE).all(axis=1)
+                    changed |= set(names[shared][drift])
+            if changed:
+                rows = np.array([name in changed for name in names])
+                index.add(list(names[rows]), matrix[rows])
+
+            if from_disk:
+                index.save(path, sync_version=self.sync_version)
+            self._indexes[model_name] = index
+
+    def save_indexes(self):
+        """Write every ANN index to ann["index_dir"], publishing pending snapshot changes first"""
+        self.flush()
+        with self._lock:
+            for model_name, index in self._indexes.items():
+                index.save(self._index_path(model_name), sync_version=self.sync_version)
+
+    def get(self, model_name):
+        """Return (names, matrix) for a model; both are empty if nothing is enrolled.
+
+        These are views of the live buffers: a later register or delete may
+        rewrite them in place.
+        """
+        model_rows = self._models.get(model_name)
+        if model_rows is None:
+            return np.empty(0, dtype=object), np.empty((0, 0), dtype=np.float32)
+        with model_rows.lock:
+            return model_rows.view()
+
+    def subset(self, names):
+        """Copy the rows of the given names into a SubGallery tagged with the current version"""
+        with self._lock:
+            models = {}
+            for model_name, model_rows in self._models.items():
+                with model_rows.lock:
+                    positions = [model_rows.rows[name] for name in names if name in model_rows.rows]
+                    models[model_name] = (model_rows.names[positions], model_rows.matrix[positions])
+            return SubGallery(models, self.version)
+
+    def apply_changes(self, changes, fetch):
+        """Replay change-log entries ({version, op, name}, ascending) newer than sync_version.
+
+        fetch(names) must return {name: embeddings} for the current state of the
+        added names; an "add" whose document is gone is treated as a removal.
+        All entries are applied under one lock; the snapshot is republished
+        when publish_interval has passed. Returns the number of entries
+        applied.
+        """
+        with self._lock, self._snapshot_lock():
+            if self.snapshot_dir:
+                self._swap_to_latest()
+            pending = [change for change in changes if change["version"] > self.sync_version]
+            if not pending:
+                return 0
+
+            current = fetch({change["name"] for change in pending if change["op"] == "add"})
+            for change in pending:
+                if change["op"] == "add" and change["name"] in current:
+                    self._put_locked(change["name"], current[change["name"]])
+                else:
+                    self._remove_locked(change["name"])
+
+            self.sync_version = pending[-1]["version"]
+            self._dirty = bool(self.snapshot_dir)
+            self._publish_if_due()
+            self.version = next(_versions)
+            return len(pending)
+
+    def _put_locked(self, name, embeddings):
+        """Write one identity's rows in place; models it no longer has lose their row"""
+        for model_name in self._models:
+            if model_name not in embeddings:
+                self._remove_row(model_name, name)
+
+        for model_name, embedding in embeddings.items():
+            row = normalize_rows(unpack_embedding(embedding))
+            model_rows = self._models.get(model_name)
+            if model_rows is None:
+                model_rows = self._models[model_name] = _ModelRows(
+                    np.empty((0, row.shape[1]), dtype=np.float32), np.empty(0, dtype=object))
+            elif model_rows.dim != row.shape[1]:
+                print(f"Skipping {model_name} embedding of {name}: "
+                      f"dimension {row.shape[1]} != {model_rows.dim}")
+                self._remove_row(model_name, name)
+                continue
+            model_rows.put(name, row[0])
+
+            if self.ann["backend"] == "hnsw":
+                if model_name not in self._indexes:
+                    self._indexes[model_name] = self._new_index(row.shape[1])
+                self._indexes[model_name].add([name], row)
+
+    def _remove_locked(self, name):
+        for model_name in self._models:
+            self._remove_row(model_name, name)
+
+    def _remove_row(self, model_name, name):
+        if self._models[model_name].remove(name) and model_name in self._indexes:
+            self._indexes[model_name].remove(name)
+
+    def search(self, model_name, queries, k=1):
+        """Return (names, distances) of the k nearest identities for each query row.
+
+        Queries must be L2-normalised. Uses the model's ANN index when the
+        gallery is large enough, otherwise exact matching.search().
+        """
+        model_rows = self._models.get(model_name)
+        index = self._indexes.get(model_name)
+        if model_rows is None:
+            indices, distances = search(queries, np.empty((0, 0), dtype=np.float32), k)
+            return np.empty(0, dtype=object)[indices], distances
+        if index is not None and model_rows.count >= self.ann["min_size"]:
+            return index.search(queries, k)
+        # The buffer is searched in place, so keep register/delete out meanwhile
+        with model_rows.lock:
+            names, matrix = model_rows.view()
+            indices, distances = search(queries, matrix, k)
+            return names[indices], distances
+
+    def nbytes(self):
+        """Memory held by the matrices (mapped snapshots included)"""
+        return sum(model_rows.nbytes() for model_rows in self._models.values())
+
+    def __len__(self):
+        models = self._models
+        if not models:
+            return 0
+        return max(model_rows.count for model_rows in models.values())
+
+
+class SubGallery:
+    """Frozen copy of part of the gallery (e.g. one event's roster), always searched exactly.
+
+    Has the same get/search interface as GalleryIndex so match_faces() can
+    use either.
+    """
+
+    def __init__(self, models, version):
+        self._models = models  # model -> (names, matrix)
+        self.version = version
+
+    def get(self, model_name):
+        return self._models.get(model_name, (np.empty(0, dtype=object), np.empty((0, 0), dtype=np.float32)))
+
+    def search(self, model_name, queries, k=1):
+        names, matrix = self.get(model_name)
+        indices, distances = search(queries, matrix, k)
+        return names[indices], distances
+
+    def __len__(self):
+        return max((len(names) for names, _ in self._models.values()), default=0)
+
+
+class Gallery:
+    """The one place that enrolls and removes faces.
+
+    Writes db.face_embeddings, records the change in the log (GallerySync)
+    and updates the in-memory GalleryIndex in place, then calls every
+    on_change listener so caches derived from the gallery can be dropped.
+    Searches and reads are delegated to the index.
+
+    Each instance covers one tenant (colid); None is the documents that
+    have no colid.
+    """
+
+    def __init__(self, db, index, model_version=None, sync_poll_interval=1.0, change_stream=False,
+                 colid=None):
+        self.db = db
+        self.collection = db.face_embeddings
+        self.index = index
+        self.model_version = model_version
+        self.colid = colid
+        self.sync = GallerySync(db, index, poll_interval=sync_poll_interval, change_stream=change_stream,
+                                colid=colid)
+        index.change_log = self.sync.changed_names
+        self._listeners = []
+
+    def start(self):
+        """Create indexes, load the gallery and start following other workers' changes"""
+        self.sync.ensure_indexes()
+        self.sync.load()
+        self.sync.start_watcher()
+
+    def on_change(self, callback):
+        self._listeners.append(callback)
+        return callback
+
+    def _changed(self, op, name, embeddings=None):
+        self.sync.commit(op, name, embeddings)
+        for callback in self._listeners:
+            callback()
+
+    def _document(self, name, embeddings):
+        return {
+            "name": name,
+            "colid": self.colid,
+            "embeddings": pack_embeddings(embeddings, self.model_version),
+            "updated_at": datetime.now()
+        }
+
+    def add(self, name, embeddings):
+        """Store and enroll a new identity ({model_name: vector})"""
+        self.collection.insert_one(self._document(name, embeddings))
+        self._changed("add", name, embeddings)
+
+    def replace(self, name, embeddings):
+        """Overwrite (or create) an identity's embeddings"""
+        self.collection.replace_one({"name": name, **tenant_filter(self.colid)},
+                                    self._document(name, embeddings), upsert=True)
+        self._changed("add", name, embeddings)
+
+    def remove(self, name):
+        """Delete an identity's embeddings; returns True if it had any"""
+        result = self.collection.delete_many({"name": name, **tenant_filter(self.colid)})
+        self._changed("remove", name)
+        return result.deleted_count > 0
+
+    def close(self):
+        """Stop following changes, e.g. when the tenant is evicted"""
+        self.sync.stop()
+        self.index.flush()
+
+    def nbytes(self):
+        return self.index.nbytes()
+
+    def refresh(self):
+        """Catch up with snapshots and change-log entries written by other workers"""
+        self.index.refresh()
+        self.sync.poll()
+
+    @property
+    def version(self):
+        return self.index.version
+
+    def get(self, model_name):
+        return self.index.get(model_name)
+
+    def search(self, model_name, queries, k=1):
+        return self.index.search(model_name, queries, k)
+
+    def subset(self, names):
+        return self.index.subset(names)
+
+    def save_indexes(self):
+        self.index.save_indexes()
+
+    def __len__(self):
+        return len(self.index)
@@ -0,0 +1,157 @@
+import threading
+import time
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+from tenants import tenant_filter
+
+
+class GallerySync:
+    """Keeps every worker's GalleryIndex in step with registers/deletes made elsewhere.
+
+    Each change bumps a counter document (meta {_id: "gallery", version}) and
+    appends {version, op, name} to gallery_changes. Workers poll the counter
+    with one find_one by _id and replay only the entries after
+    index.sync_version, fetching the embeddings of added names, instead of
+    reloading the whole gallery. With change_stream=True a watcher thread on
+    gallery_changes applies changes as soon as they are written, where the
+    deployment supports change streams (replica sets / Atlas); otherwise it
+    falls back to polling.
+
+    Each tenant (colid) has its own counter ("gallery:<colid>") and its
+    entries carry the colid; the default tenant keeps the plain "gallery"
+    counter.
+
+    Only needs a pymongo-compatible database handle, so a mongomock database
+    works for local testing.
+    """
+
+    COUNTER_ID = "gallery"
+    GAP_GRACE_SECONDS = 10
+
+    def __init__(self, db, index, poll_interval=1.0, change_stream=False, retention_days=7, colid=None):
+        self.db = db
+        self.index = index
+        self.poll_interval = poll_interval
+        self.change_stream = change_stream
+        self.retention_days = retention_days
+        self.colid = colid
+        self.counter_id = f"{self.COUNTER_ID}:{colid}" if colid else self.COUNTER_ID
+        self._lock = threading.Lock()
+        self._next_poll = 0
+        self._watcher = None
+        self._stopped = threading.Event()
+
+    def ensure_indexes(self):
+        if "version_1" in self.db.gallery_changes.index_information():
+            self.db.gallery_changes.drop_index("version_1")  # versions are per tenant now
+        self.db.gallery_changes.create_index([("colid", 1), ("version", 1)], unique=True)
+        self.db.gallery_changes.create_index("at", expireAfterSeconds=self.retention_days * 86400)
+
+    def current_version(self):
+        doc = self.db.meta.find_one({"_id": self.counter_id}, {"version": 1})
+        return doc["version"] if doc else 0
+
+    def load(self):
+        """Full load of the gallery, tagged with the change-log version it starts from"""
+        self.index.load(sync_version=self.current_version())
+
+    def record(self, op, name):
+        """Append one change ("add" or "remove") to the log and return its version"""
+        version = self.db.meta.find_one_and_update(
+            {"_id": self.counter_id},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )["version"]
+        self.db.gallery_changes.insert_one({"colid": self.colid, "version": version, "op": op,
+                                            "name": name, "at": datetime.utcnow()})
+        return version
+
+    def changed_names(self, since, until):
+        """Names of the entries in (since, until], or None if the log no longer has all of them"""
+        if until <= since:
+            return set()
+        changes = list(self.db.gallery_changes.find(
+            {"version": {"$gt": since, "$lte": until}, **tenant_filter(self.colid)},
+            {"_id": 0, "name": 1}
+        ))
+        if len(changes) != until - since:
+            return None
+        return {change["name"] for change in changes}
+
+    def commit(self, op, name, embeddings=None):
+        """Record a local change and apply it (plus anything missed) to this worker's index"""
+        self.record(op, name)
+        known = {name: embeddings} if embeddings is not None else {}
+        self.poll(force=True, known=known)
+
+    def poll(self, force=False, known=None):
+        """Apply changes newer than the gallery; cheap no-op when nothing changed"""
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return 0
+        self._next_poll = now + self.poll_interval
+
+        with self._lock:
+            latest = self.current_version()
+            since = self.index.sync_version
+            if latest <= since:
+                return 0
+
+            changes = list(self.db.gallery_changes.find(
+                {"version": {"$gt": since}, **tenant_filter(self.colid)},
+                {"_id": 0, "version": 1, "op": 1, "name": 1, "at": 1}
+            ).sort("version", 1))
+            if not changes:
+                return 0  # counter bumped but the entry is not written yet
+            if changes[0]["version"] != since + 1:
+                # Either a writer is between $inc and insert, or the entry will
+                # never come (expired from the log, or the writer died)
+                if (datetime.utcnow() - changes[0]["at"]).total_seconds() < self.GAP_GRACE_SECONDS:
+                    return 0
+                print("Gallery change log has a gap, reloading the whole gallery")
+                self.index.load(sync_version=latest)
+                return len(changes)
+
+            contiguous = [changes[0]]
+            for change in changes[1:]:
+                if change["version"] != contiguous[-1]["version"] + 1:
+                    break
+                contiguous.append(change)
+
+            known = known or {}
+
+            def fetch(names):
+                current = {name: known[name] for name in names if name in known}
+                missing = [name for name in names if name not in known]
+                if missing:
+                    query = {"name": {"$in": missing}, **tenant_filter(self.colid)}
+                    for doc in self.db.face_embeddings.find(query, {"name": 1, "embeddings": 1}):
+                        current[doc["name"]] = doc.get("embeddings", {})
+                return current
+
+            return self.index.apply_changes(contiguous, fetch)
+
+    def start_watcher(self):
+        """Apply changes as they are inserted, if the server supports change streams"""
+        if not self.change_stream or self._watcher is not None:
+            return
+
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.colid": self.colid}}]
+
+        def watch():
+            try:
+                with self.db.gallery_changes.watch(pipeline, max_await_time_ms=1000) as stream:
+                    while not self._stopped.is_set():
+                        if stream.try_next() is not None:
+                            self.poll(force=True)
+            except Exception as e:
+                print(f"Gallery change stream unavailable, polling instead: {str(e)}")
+
+        self._watcher = threading.Thread(target=watch, name="gallery-watch", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stopped.set()
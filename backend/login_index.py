@@ -0,0 +1,112 @@
+import threading
+import time
+from datetime import timedelta
+
+import face_recognition
+import numpy as np
+from bson import ObjectId
+
+# ObjectIds come from each writer's clock; look this far back for late inserts
+CLOCK_SKEW_SECONDS = 60
+
+
+class EncodingIndex:
+    """In-memory N x 128 matrix of the dlib face encodings of all students.
+
+    Reads the compact student_encodings collection ({_id: student _id,
+    colid, face_encoding}) and lets /login_face compare a captured face
+    against every user with a single face_distance() call. query limits it
+    to one tenant's students.
+
+    Students registered through another worker are picked up by refresh(),
+    which at most every poll_interval seconds reads only the encodings
+    whose ObjectId is newer than the newest one already loaded.
+    """
+
+    def __init__(self, collection, query=None, poll_interval=5.0):
+        self.collection = collection
+        self.query = query or {}
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._ids = []
+        self._known = set()
+        self._newest = None  # generation time of the newest ObjectId loaded
+        self._matrix = np.empty((0, 128))
+        self._next_poll = 0
+
+    def _find(self, extra=None):
+        query = {**self.query, "face_encoding": {"$exists": True, "$ne": None}, **(extra or {})}
+        for doc in self.collection.find(query, {"face_encoding": 1}):
+            if doc["face_encoding"]:
+                yield doc["_id"], doc["face_encoding"]
+
+    def load(self):
+        """Read every stored encoding"""
+        ids = []
+        encodings = []
+        for user_id, encoding in self._find():
+            ids.append(user_id)
+            encodings.append(encoding)
+
+        with self._lock:
+            self._ids = ids
+            self._known = set(ids)
+            self._newest = None
+            self._track_newest(ids)
+            self._matrix = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+        self._next_poll = time.monotonic() + self.poll_interval
+
+        print(f"Loaded {len(ids)} login face encodings")
+
+    def _track_newest(self, ids):
+        for user_id in ids:
+            if isinstance(user_id, ObjectId) and (self._newest is None or user_id.generation_time > self._newest):
+                self._newest = user_id.generation_time
+
+    def add(self, user_id, encoding):
+        self._add_many([user_id], [encoding])
+
+    def _add_many(self, ids, encodings):
+        with self._lock:
+            rows = [(user_id, encoding) for user_id, encoding in zip(ids, encodings)
+                    if user_id not in self._known]
+            if not rows:
+                return 0
+            self._ids = self._ids + [user_id for user_id, _ in rows]
+            self._known.update(user_id for user_id, _ in rows)
+            self._track_newest([user_id for user_id, _ in rows])
+            self._matrix = np.vstack([self._matrix,
+                                      np.asarray([encoding for _, encoding in rows], dtype=np.float64)])
+            return len(rows)
+
+    def refresh(self):
+        """Append students other workers registered since the last check; returns how many"""
+        now = time.monotonic()
+        if now < self._next_poll:
+            return 0
+        self._next_poll = now + self.poll_interval
+        extra = None
+        if self._newest is not None:
+            extra = {"_id": {"$gte": ObjectId.from_datetime(self._newest - timedelta(seconds=CLOCK_SKEW_SECONDS))}}
+        ids, encodings = [], []
+        for user_id, encoding in self._find(extra):
+            if user_id not in self._known:
+                ids.append(user_id)
+                encodings.append(encoding)
+        return self._add_many(ids, encodings) if ids else 0
+
+    def nbytes(self):
+        return self._matrix.nbytes
+
+    def match(self, encoding, tolerance):
+        """Return (user_id, distance) of the closest user within tolerance, else (None, None)"""
+        with self._lock:
+            ids, matrix = self._ids, self._matrix
+        if not ids:
+            return None, None
+
+        distances = face_recognition.face_distance(matrix, encoding)
+        best = int(np.argmin(distances))
+        if distances[best] > tolerance:
+            return None, None
+        return ids[best], float(distances[best])
@@ -0,0 +1,41 @@
+import numpy as np
+
+
+def normalize_rows(matrix):
+    """L2-normalise each row of a matrix (or a single vector) as float32"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def search(queries, gallery, k=1):
+    """Find the k closest gallery rows for every query row.
+
+    Both inputs must already be L2-normalised, so one matrix product gives the
+    cosine similarity of every query against every enrolled identity. Returns
+    (indices, distances), each of shape (len(queries), k), where distances are
+    cosine distances sorted ascending. Column 0 is always the first best row,
+    which matches the tie-breaking of a linear scan with a strict `<`.
+    """
+    n = gallery.shape[0]
+    if n == 0 or len(queries) == 0:
+        empty = np.empty((len(queries), 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+
+    sims = queries @ gallery.T
+    best = np.argmax(sims, axis=1)[:, None]
+
+    k = min(k, n)
+    if k <= 1:
+        indices = best
+    else:
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(sims, part, axis=1), axis=1, kind="stable")
+        indices = np.take_along_axis(part, order, axis=1)
+        indices[:, 0] = best[:, 0]
+
+    distances = 1.0 - np.take_along_axis(sims, indices, axis=1)
+    return indices, distances
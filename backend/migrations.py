@@ -0,0 +1,213 @@
+"""One-shot data migrations for the face recognition database.
+
+Run from the backend directory with the same environment as the app:
+
+    python migrations.py students     # photos to GridFS, encodings to student_encodings
+    python migrations.py embeddings   # face_embeddings arrays to packed float32
+    python migrations.py tenants      # copy each student's colid onto its encoding
+    python migrations.py attendance_day  # derive attendance.day, drop same-day duplicates
+    python migrations.py attendance_counters  # participants.attendance array to counters
+    python migrations.py stats        # rebuild per-event attendance statistics
+"""
+import argparse
+import base64
+
+from dotenv import load_dotenv
+from gridfs import GridFS
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import attendance
+from connection import DATABASE_NAME, get_mongo_client
+from embedding_codec import is_packed, pack_embedding
+from stats import AttendanceStats
+
+
+def migrate_students(db):
+    """Move photos to GridFS and encodings (with the student's colid) to student_encodings.
+
+    Idempotent: only documents that still carry a base64 photo or an embedded
+    face_encoding are touched, and the fields are unset once copied.
+    """
+    fs = GridFS(db)
+    query = {"$or": [{"photo": {"$exists": True}}, {"face_encoding": {"$exists": True}}]}
+    migrated = 0
+
+    for doc in db.students.find(query, {"photo": 1, "face_encoding": 1, "name": 1, "colid": 1}):
+        update = {"$unset": {"photo": "", "face_encoding": ""}}
+
+        photo = doc.get("photo")
+        if isinstance(photo, str) and "," in photo:
+            header, encoded = photo.split(",", 1)
+            content_type = header.split(":", 1)[-1].split(";", 1)[0] or "image/jpeg"
+            photo_id = fs.put(base64.b64decode(encoded), filename=doc.get("name", ""),
+                              content_type=content_type)
+            update["$set"] = {"photo_id": photo_id}
+
+        if doc.get("face_encoding"):
+            db.student_encodings.replace_one(
+                {"_id": doc["_id"]},
+                {"_id": doc["_id"], "colid": doc.get("colid"), "face_encoding": doc["face_encoding"]},
+                upsert=True
+            )
+
+        db.students.update_one({"_id": doc["_id"]}, update)
+        migrated += 1
+
+    print(f"Migrated {migrated} student documents")
+
+
+def migrate_embeddings(db, batch_size=500):
+    """Rewrite legacy BSON double arrays in face_embeddings as packed float32 blobs.
+
+    Documents that are already packed are left alone, so it is safe to re-run.
+    """
+    requests = []
+    migrated = 0
+
+    for doc in db.face_embeddings.find({}, {"embeddings": 1}):
+        embeddings = doc.get("embeddings", {})
+        legacy = {model_name: value for model_name, value in embeddings.items() if not is_packed(value)}
+        if not legacy:
+            continue
+
+        update = {f"embeddings.{model_name}": pack_embedding(value, "legacy")
+                  for model_name, value in legacy.items()}
+        requests.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+        migrated += 1
+
+        if len(requests) >= batch_size:
+            db.face_embeddings.bulk_write(requests, ordered=False)
+            requests = []
+
+    if requests:
+        db.face_embeddings.bulk_write(requests, ordered=False)
+    print(f"Packed embeddings of {migrated} documents")
+
+
+def migrate_tenants(db, batch_size=500):
+    """Copy students.colid onto student_encodings so login indexes can be partitioned by college.
+
+    Participants and face embeddings without a colid stay in the default
+    tenant, so they need no backfill.
+    """
+    requests = []
+    migrated = 0
+
+    for doc in db.students.find({"colid": {"$nin": [None, ""]}}, {"colid": 1}):
+        requests.append(UpdateOne({"_id": doc["_id"], "colid": {"$ne": doc["colid"]}},
+                                  {"$set": {"colid": doc["colid"]}}))
+        if len(requests) >= batch_size:
+            migrated += db.student_encodings.bulk_write(requests, ordered=False).modified_count
+            requests = []
+
+    if requests:
+        migrated += db.student_encodings.bulk_write(requests, ordered=False).modified_count
+    print(f"Set colid on {migrated} student encodings")
+
+
+def migrate_attendance_day(db, batch_size=500):
+    """Set attendance.day from each record's timestamp and build the unique per-day index.
+
+    Records are processed oldest first; one that collides with an existing
+    (participant_id, event, day) record is a duplicate the old check-then-
+    insert let through, and is deleted.
+    """
+    attendance.ensure_indexes(db)
+    migrated = 0
+    removed = 0
+
+    def flush(batch):
+        """Apply [(_id, day)] in order; returns (modified, deleted duplicates)"""
+        try:
+            result = db.attendance.bulk_write([UpdateOne({"_id": _id}, {"$set": {"day": day}})
+                                               for _id, day in batch], ordered=True)
+            return result.modified_count, 0
+        except BulkWriteError as e:
+            if any(error["code"] != attendance.DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+            # Ordered: everything before the first duplicate was applied
+            failed = e.details["writeErrors"][0]["index"]
+            db.attendance.delete_one({"_id": batch[failed][0]})
+            modified, deleted = flush(batch[failed + 1:]) if failed + 1 < len(batch) else (0, 0)
+            return e.details["nModified"] + modified, deleted + 1
+
+    batch = []
+    query = {"day": {"$exists": False}, "timestamp": {"$type": "date"}}
+    for doc in db.attendance.find(query, {"timestamp": 1}).sort("timestamp", 1):
+        batch.append((doc["_id"], attendance.attendance_day(doc["timestamp"])))
+        if len(batch) >= batch_size:
+            modified, deleted = flush(batch)
+            migrated, removed = migrated + modified, removed + deleted
+            batch = []
+
+    if batch:
+        modified, deleted = flush(batch)
+        migrated, removed = migrated + modified, removed + deleted
+    print(f"Set day on {migrated} attendance records, removed {removed} duplicates")
+
+
+def migrate_attendance_counters(db, batch_size=500):
+    """Replace the embedded participants.attendance arrays with counters.
+
+    Totals, per-event counts and last_seen are recomputed from the
+    attendance collection (the source of truth), so re-running fixes any
+    drift; the arrays are then unset.
+    """
+    counters = {}
+    pipeline = [
+        {"$match": {"participant_id": {"$exists": True}}},
+        {"$group": {"_id": {"participant": "$participant_id", "event": "$event"},
+                    "count": {"$sum": 1}, "last_seen": {"$max": "$timestamp"}}}
+    ]
+    for row in db.attendance.aggregate(pipeline, allowDiskUse=True):
+        entry = counters.setdefault(row["_id"]["participant"], {
+            attendance.COUNT_FIELD: 0, attendance.EVENTS_FIELD: {}, attendance.LAST_SEEN_FIELD: None})
+        entry[attendance.COUNT_FIELD] += row["count"]
+        entry[attendance.EVENTS_FIELD][attendance.event_key(row["_id"]["event"])] = row["count"]
+        if entry[attendance.LAST_SEEN_FIELD] is None or row["last_seen"] > entry[attendance.LAST_SEEN_FIELD]:
+            entry[attendance.LAST_SEEN_FIELD] = row["last_seen"]
+
+    requests = []
+    updated = 0
+    for doc in db.participants.find({}, {"_id": 1}):
+        values = counters.get(doc["_id"], {
+            attendance.COUNT_FIELD: 0, attendance.EVENTS_FIELD: {}, attendance.LAST_SEEN_FIELD: None})
+        requests.append(UpdateOne({"_id": doc["_id"]}, {"$set": values, "$unset": {"attendance": ""}}))
+        if len(requests) >= batch_size:
+            updated += db.participants.bulk_write(requests, ordered=False).modified_count
+            requests = []
+
+    if requests:
+        updated += db.participants.bulk_write(requests, ordered=False).modified_count
+    print(f"Set attendance counters on {updated} participants")
+
+
+def migrate_stats(db):
+    """Rebuild attendance_stats, attendance_days and the totals from the attendance collection.
+
+    Run after attendance_day, since sessions are counted per stored day.
+    """
+    stats = AttendanceStats(db)
+    stats.ensure_indexes()
+    print(f"Rebuilt attendance statistics for {stats.rebuild()} events")
+
+
+MIGRATIONS = {
+    "students": migrate_students,
+    "embeddings": migrate_embeddings,
+    "tenants": migrate_tenants,
+    "attendance_day": migrate_attendance_day,
+    "attendance_counters": migrate_attendance_counters,
+    "stats": migrate_stats,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = get_mongo_client()
+    MIGRATIONS[args.migration](client[DATABASE_NAME])
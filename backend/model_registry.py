@@ -0,0 +1,121 @@
+import threading
+import time
+
+
+class ModelRegistry:
+    """Builds recognition models and face detectors on demand and tracks their state.
+
+    Models live in the app's MODELS config; the registry fills in
+    MODELS[name]["model"] the first time a model is needed (or from a
+    background thread) and then runs one dummy inference so graph tracing is
+    paid before real traffic. A model that fails to build is disabled, as the
+    old import-time loop did.
+
+    With lazy=True nothing is loaded ahead of use, so models and detectors
+    that have not been needed yet are reported as "lazy" and do not hold
+    back readiness.
+    """
+
+    def __init__(self, models, detectors, build_model, warm_up_model, warm_up_detector, lazy=False):
+        self.models = models
+        self.lazy = lazy
+        self.detectors = detectors
+        self._build_model = build_model
+        self._warm_up_model = warm_up_model
+        self._warm_up_detector = warm_up_detector
+        self._locks = {}
+        self._status = {}
+        for name in list(models) + list(detectors):
+            self._locks[name] = threading.RLock()
+            self._status[name] = {"state": "lazy" if lazy else "pending", "load_seconds": None,
+                                  "warmup_seconds": None, "error": None}
+        self._thread = None
+
+    def ensure(self, model_name):
+        """Return the built model, loading and warming it up first if needed.
+
+        Returns None if the model is disabled or failed to load.
+        """
+        config = self.models[model_name]
+        if config["model"] is not None:
+            return config["model"]
+        if not config["enabled"]:
+            return None
+
+        with self._locks[model_name]:
+            if config["model"] is not None or not config["enabled"]:
+                return config["model"]
+            status = self._status[model_name]
+            status["state"] = "loading"
+            try:
+                start = time.perf_counter()
+                model = self._build_model(model_name)
+                status["load_seconds"] = time.perf_counter() - start
+                config["model"] = model
+                print(f"Initialized {model_name} model successfully")
+            except Exception as e:
+                print(f"Error initializing {model_name}: {str(e)}")
+                status.update(state="failed", error=str(e))
+                config["enabled"] = False
+                return None
+
+            self._run_warm_up(model_name, self._warm_up_model)
+            return model
+
+    def ensure_detector(self, detector):
+        """Load a detector's weights by running it once on a dummy frame"""
+        status = self._status[detector]
+        if status["state"] in ("ready", "failed"):
+            return
+        with self._locks[detector]:
+            if status["state"] in ("ready", "failed"):
+                return
+            status["state"] = "loading"
+            self._run_warm_up(detector, self._warm_up_detector)
+
+    def _run_warm_up(self, name, warm_up):
+        status = self._status[name]
+        status["state"] = "warming_up"
+        try:
+            start = time.perf_counter()
+            warm_up(name)
+            status["warmup_seconds"] = time.perf_counter() - start
+            status["state"] = "ready"
+        except Exception as e:
+            # The model itself is usable; only the warm-up inference failed
+            print(f"Warm-up of {name} failed: {str(e)}")
+            status.update(state="ready", error=f"warm-up failed: {str(e)}")
+
+    def load_all(self):
+        """Build and warm up every enabled model and every detector"""
+        for model_name, config in self.models.items():
+            if config["enabled"]:
+                self.ensure(model_name)
+            else:
+                self._status[model_name]["state"] = "disabled"
+        for detector in self.detectors:
+            self.ensure_detector(detector)
+
+    def start_background(self):
+        """Run load_all() in a daemon thread so the server can start accepting requests"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.load_all, name="model-warmup", daemon=True)
+            self._thread.start()
+
+    def status(self):
+        """Per-model and per-detector state plus an overall readiness flag"""
+        entries = {name: dict(status) for name, status in self._status.items()}
+        for model_name, config in self.models.items():
+            if not config["enabled"] and entries[model_name]["state"] in ("pending", "lazy"):
+                entries[model_name]["state"] = "disabled"
+
+        # Lazy loading happens inside requests, so it never makes the service unready
+        settled = self.lazy or all(entry["state"] in ("ready", "failed", "disabled")
+                                   for entry in entries.values())
+        usable = ("ready", "lazy", "loading", "warming_up") if self.lazy else ("ready",)
+        any_model = any(entries[model_name]["state"] in usable for model_name in self.models)
+        return {
+            "ready": settled and any_model,
+            "models": {name: entries[name] for name in self.models},
+            "detectors": {name: entries[name] for name in self.detectors}
+        }
@@ -0,0 +1,85 @@
+import os
+
+import cv2
+
+# Smallest face, in downscaled pixels, the pre-detectors find reliably
+DETECTOR_MIN_SIZE = 20
+
+
+class PreDetector:
+    """Cheap face pre-detector that runs on a downscaled copy of the frame.
+
+    Used in front of RetinaFace/MTCNN: if it finds nothing the heavy detectors
+    are skipped, otherwise they only see padded candidate regions. Backends are
+    OpenCV's YuNet (needs the ONNX model file) and the bundled Haar cascade.
+
+    Frames are shrunk towards max_side, but never so far that a face of
+    min_face pixels in the original drops below DETECTOR_MIN_SIZE: a 4000px
+    group photo is scanned at 2000px by default rather than 640px, where
+    its ~100px faces would be too small for the cascade.
+    """
+
+    def __init__(self, backend="haar", max_side=640, padding=0.6, yunet_model=None,
+                 score_threshold=0.6, min_face=40):
+        self.max_side = max_side
+        self.min_face = min_face
+        self.padding = padding
+        self.backend = backend
+        self._detector = None
+
+        if backend == "yunet":
+            if yunet_model and os.path.exists(yunet_model) and hasattr(cv2, "FaceDetectorYN"):
+                self._detector = cv2.FaceDetectorYN.create(yunet_model, "", (320, 320), score_threshold)
+            else:
+                print("YuNet model not available, using the Haar cascade pre-detector")
+                self.backend = "haar"
+
+        if self.backend == "haar":
+            cascade = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+            self._detector = cv2.CascadeClassifier(cascade)
+
+    def _detect(self, small):
+        """Return (x, y, w, h) boxes in the downscaled image"""
+        if self.backend == "yunet":
+            self._detector.setInputSize((small.shape[1], small.shape[0]))
+            _, faces = self._detector.detect(small)
+            return [] if faces is None else [tuple(int(v) for v in face[:4]) for face in faces]
+
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        faces = self._detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=3,
+                                                minSize=(DETECTOR_MIN_SIZE, DETECTOR_MIN_SIZE))
+        return [tuple(int(v) for v in face) for face in faces]
+
+    def regions(self, image):
+        """Return padded candidate regions as (x0, y0, x1, y1) in original coordinates.
+
+        Overlapping regions are merged so a face is never handed to the heavy
+        detector twice. An empty list means no face is present.
+        """
+        height, width = image.shape[:2]
+        scale = min(1.0, max(self.max_side / max(height, width), DETECTOR_MIN_SIZE / self.min_face))
+        small = image if scale == 1.0 else cv2.resize(image, (int(width * scale), int(height * scale)),
+                                                      interpolation=cv2.INTER_AREA)
+
+        boxes = []
+        for x, y, w, h in self._detect(small):
+            x, y, w, h = x / scale, y / scale, w / scale, h / scale
+            pad_w, pad_h = w * self.padding, h * self.padding
+            boxes.append([max(0, int(x - pad_w)), max(0, int(y - pad_h)),
+                          min(width, int(x + w + pad_w)), min(height, int(y + h + pad_h))])
+
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(boxes)):
+                for j in range(i + 1, len(boxes)):
+                    a, b = boxes[i], boxes[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del boxes[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+
+        return [tuple(box) for box in boxes]
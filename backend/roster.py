@@ -0,0 +1,59 @@
+from cache import TTLCache
+from tenants import tenant_filter
+
+ROSTER_FIELDS = ("event", "class", "course_code")
+NO_ROSTER = object()  # cached for events without a roster
+
+
+class RosterGalleries:
+    """Sub-galleries holding only the expected participants of an event, class or course.
+
+    A class or course_code roster is every participant with that field. An
+    event roster is the event's own "participants" list plus everyone in its
+    "class"/"course_code"; an event with none of those has no roster, and
+    get() returns the whole gallery so newcomers are never forced onto a
+    past attendee.
+
+    Sub-galleries are cut from one tenant's gallery and cached per (colid,
+    field, value, gallery version), so a register or delete is never served
+    from a stale roster; entries also expire after ttl seconds to pick up
+    participant or event edits.
+    """
+
+    def __init__(self, db, maxsize=64, ttl=300):
+        self.db = db
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def members(self, field, value, colid=None):
+        """Names on a roster, or None for an event without one; raises ValueError for an unknown field or event"""
+        if field not in ROSTER_FIELDS:
+            raise ValueError(f"Unknown roster field: {field}")
+        if field != "event":
+            return set(self.db.participants.distinct("name", {field: value, **tenant_filter(colid)}))
+
+        event = self.db.events.find_one({"name": value}, {"participants": 1, "class": 1, "course_code": 1})
+        if event is None:
+            raise ValueError(f"Event not found: {value}")
+        if not any(event.get(key) for key in ("participants", "class", "course_code")):
+            return None
+        names = set(event.get("participants") or [])
+        for roster_field in ("class", "course_code"):
+            if event.get(roster_field):
+                names |= self.members(roster_field, event[roster_field], colid)
+        return names
+
+    def get(self, gallery, field, value):
+        """SubGallery for a roster, built from a tenant's in-memory gallery on a miss.
+
+        Returns the gallery itself when the event has no roster.
+        """
+        key = (gallery.colid, field, value, gallery.version)
+        sub_gallery = self.cache.get(key)
+        if sub_gallery is None:
+            names = self.members(field, value, gallery.colid)
+            sub_gallery = NO_ROSTER if names is None else gallery.subset(names)
+            self.cache.put(key, sub_gallery)
+        return gallery if sub_gallery is NO_ROSTER else sub_gallery
+
+    def clear(self):
+        self.cache.clear()
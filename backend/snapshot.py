@@ -0,0 +1,111 @@
+import fcntl
+import json
+import os
+import shutil
+from contextlib import contextmanager
+
+import numpy as np
+
+CURRENT_FILE = "CURRENT"
+KEEP_GENERATIONS = 3
+
+
+def generation_dir(directory, generation):
+    return os.path.join(directory, f"gen-{generation:08d}")
+
+
+def current_generation(directory):
+    """Generation number CURRENT points at, or 0 if nothing was published yet"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+@contextmanager
+def snapshot_lock(directory):
+    """Exclusive lock shared by every process publishing to a snapshot directory"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def begin_generation(directory):
+    """Create the next, still invisible generation directory; returns (generation, path).
+
+    The caller must hold snapshot_lock(directory), fill the directory and
+    then call commit_generation().
+    """
+    generation = current_generation(directory) + 1
+    target = generation_dir(directory, generation)
+    shutil.rmtree(target, ignore_errors=True)  # leftover of a crashed publisher
+    os.makedirs(target)
+    return generation, target
+
+
+def commit_generation(directory, generation):
+    """Atomically point CURRENT at a generation and prune the old ones"""
+    tmp = os.path.join(directory, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        f.write(str(generation))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(directory, CURRENT_FILE))
+
+    # Workers still mapping an old generation keep their pages after unlink
+    for old in range(generation - KEEP_GENERATIONS, 0, -1):
+        path = generation_dir(directory, old)
+        if not os.path.exists(path):
+            break
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def publish_snapshot(directory, matrices, names, meta=None):
+    """Write a new generation (<model>.npy + <model>.names.json + meta.json) and point CURRENT at it.
+
+    Generations are written to their own directory and only become visible
+    when CURRENT is atomically replaced, so readers never see a partial
+    snapshot. The caller must hold snapshot_lock(directory). Returns the new
+    generation number.
+    """
+    generation, target = begin_generation(directory)
+
+    for model_name, matrix in matrices.items():
+        np.save(os.path.join(target, f"{model_name}.npy"), np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(os.path.join(target, f"{model_name}.names.json"), "w") as f:
+            json.dump([str(name) for name in names[model_name]], f)
+    with open(os.path.join(target, "meta.json"), "w") as f:
+        json.dump(meta or {}, f)
+
+    commit_generation(directory, generation)
+    return generation
+
+
+def snapshot_meta(directory, generation):
+    """meta.json of a published generation, without mapping its matrices"""
+    path = os.path.join(generation_dir(directory, generation), "meta.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def open_snapshot(directory, generation):
+    """Memory-map a published generation; returns (matrices, names, meta)"""
+    source = generation_dir(directory, generation)
+    matrices = {}
+    names = {}
+    meta = snapshot_meta(directory, generation)
+    for filename in os.listdir(source):
+        if not filename.endswith(".npy"):
+            continue
+        model_name = filename[:-len(".npy")]
+        matrices[model_name] = np.load(os.path.join(source, filename), mmap_mode="r")
+        with open(os.path.join(source, f"{model_name}.names.json")) as f:
+            names[model_name] = np.array(json.load(f), dtype=object)
+    return matrices, names, meta
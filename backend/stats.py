@@ -0,0 +1,153 @@
+from pymongo import ReturnDocument, UpdateOne
+
+from attendance import COUNT_FIELD, EVENTS_FIELD, LAST_SEEN_FIELD, event_key
+
+TOTALS_ID = "attendance_stats"
+
+
+class AttendanceStats:
+    """Attendance statistics kept up to date on every mark and delete.
+
+    Per event, attendance_stats holds {_id: event, key, records, sessions,
+    last_marked}, where key is the event's field under attendance_events
+    and a session is a day with at least one record. attendance_days counts
+    the records of each (event, day) so sessions can be added and removed
+    exactly. Totals live in meta {_id: "attendance_stats"}. Per-participant
+    counts are the counters kept on participants by attendance.mark(), so
+    every read here is an indexed lookup rather than an aggregation over
+    attendance.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def ensure_indexes(self):
+        self.db.attendance_stats.create_index("key")
+
+    def marked(self, event, day, count, now):
+        """count new records for an event on a day"""
+        if count <= 0:
+            return
+        before = self.db.attendance_days.find_one_and_update(
+            {"_id": {"event": event, "day": day}},
+            {"$inc": {"count": count}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        new_session = 1 if before is None or before.get("count", 0) <= 0 else 0
+        self.db.attendance_stats.update_one(
+            {"_id": event},
+            {"$inc": {"records": count, "sessions": new_session}, "$max": {"last_marked": now},
+             "$setOnInsert": {"key": event_key(event)}},
+            upsert=True
+        )
+        self.db.meta.update_one({"_id": TOTALS_ID},
+                                {"$inc": {"records": count, "sessions": new_session}}, upsert=True)
+
+    def unmarked(self, event, day):
+        """One record of an event on a day was deleted"""
+        after = self.db.attendance_days.find_one_and_update(
+            {"_id": {"event": event, "day": day}, "count": {"$gt": 0}},
+            {"$inc": {"count": -1}},
+            return_document=ReturnDocument.AFTER
+        )
+        ended_session = 0
+        if after is not None and after["count"] <= 0:
+            self.db.attendance_days.delete_one({"_id": after["_id"], "count": {"$lte": 0}})
+            ended_session = 1
+        self.db.attendance_stats.update_one({"_id": event},
+                                            {"$inc": {"records": -1, "sessions": -ended_session}})
+        self.db.meta.update_one({"_id": TOTALS_ID}, {"$inc": {"records": -1, "sessions": -ended_session}})
+
+    def totals(self):
+        doc = self.db.meta.find_one({"_id": TOTALS_ID}) or {}
+        return {
+            "records": doc.get("records", 0),
+            "sessions": doc.get("sessions", 0),
+            "participants": self.db.participants.estimated_document_count(),
+            "events": self.db.attendance_stats.estimated_document_count()
+        }
+
+    def events(self, query=None):
+        """{event: {records, sessions, last_marked, average_per_session}}"""
+        result = {}
+        for doc in self.db.attendance_stats.find(query or {}):
+            sessions = doc.get("sessions", 0)
+            result[doc["_id"]] = {
+                "records": doc.get("records", 0),
+                "sessions": sessions,
+                "last_marked": doc.get("last_marked"),
+                "average_per_session": doc.get("records", 0) / sessions if sessions else 0
+            }
+        return result
+
+    def participant(self, query):
+        """Counters and computed attendance_percentage of one participant, or None.
+
+        The percentage is attended sessions over the sessions held by every
+        event the participant is expected at (the event lists them, or
+        shares their class or course_code; see roster.py) plus any other
+        event they attended, overall and per event. Events they skipped
+        entirely therefore count against them.
+        """
+        doc = self.db.participants.find_one(query, {"name": 1, "class": 1, "course_code": 1, COUNT_FIELD: 1,
+                                                    EVENTS_FIELD: 1, LAST_SEEN_FIELD: 1})
+        if doc is None:
+            return None
+        counts = doc.get(EVENTS_FIELD, {})
+        roster = [{"participants": doc.get("name")}]
+        roster += [{field: doc[field]} for field in ("class", "course_code") if doc.get(field)]
+        expected = self.db.events.distinct("name", {"$or": roster})
+        events = self.events({"$or": [{"_id": {"$in": expected}}, {"key": {"$in": list(counts)}}]})
+
+        per_event = {}
+        attended = held = 0
+        for name in set(expected) | set(events):
+            sessions = events.get(name, {}).get("sessions", 0)
+            count = counts.get(event_key(name), 0)
+            per_event[name] = {
+                "attended": count,
+                "sessions": sessions,
+                "attendance_percentage": round(100.0 * count / sessions, 2) if sessions else 0
+            }
+            attended += count
+            held += sessions
+        return {
+            "name": doc.get("name"),
+            "attendance_count": doc.get(COUNT_FIELD, 0),
+            "last_seen": doc.get(LAST_SEEN_FIELD),
+            "attendance_percentage": round(100.0 * attended / held, 2) if held else 0,
+            "events": per_event
+        }
+
+    def rebuild(self, batch_size=500):
+        """Recompute every statistic from the attendance collection"""
+        days = list(self.db.attendance.aggregate([
+            {"$match": {"day": {"$exists": True}}},
+            {"$group": {"_id": {"event": "$event", "day": "$day"},
+                        "count": {"$sum": 1}, "last_marked": {"$max": "$timestamp"}}}
+        ], allowDiskUse=True))
+
+        events = {}
+        for row in days:
+            entry = events.setdefault(row["_id"]["event"], {"records": 0, "sessions": 0, "last_marked": None})
+            entry["records"] += row["count"]
+            entry["sessions"] += 1
+            if entry["last_marked"] is None or row["last_marked"] > entry["last_marked"]:
+                entry["last_marked"] = row["last_marked"]
+
+        self.db.attendance_days.delete_many({})
+        self.db.attendance_stats.delete_many({})
+        for start in range(0, len(days), batch_size):
+            self.db.attendance_days.insert_many([{"_id": row["_id"], "count": row["count"]}
+                                                 for row in days[start:start + batch_size]])
+        requests = [UpdateOne({"_id": event}, {"$set": dict(values, key=event_key(event))}, upsert=True)
+                    for event, values in events.items()]
+        for start in range(0, len(requests), batch_size):
+            self.db.attendance_stats.bulk_write(requests[start:start + batch_size], ordered=False)
+        self.db.meta.replace_one({"_id": TOTALS_ID}, {
+            "_id": TOTALS_ID,
+            "records": sum(entry["records"] for entry in events.values()),
+            "sessions": sum(entry["sessions"] for entry in events.values())
+        }, upsert=True)
+        return len(events)
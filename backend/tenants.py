@@ -0,0 +1,161 @@
+import re
+import threading
+from collections import OrderedDict
+
+from cache import TTLCache
+
+DEFAULT_TENANT = "default"
+
+
+def tenant_filter(colid):
+    """Query selecting one college's documents; no colid selects the ones without a colid"""
+    if colid:
+        return {"colid": colid}
+    return {"colid": {"$in": [None, ""]}}
+
+
+def tenant_dirname(colid):
+    """Filesystem-safe directory name for a tenant's snapshots and indexes"""
+    if not colid:
+        return DEFAULT_TENANT
+    return "colid-" + re.sub(r"[^A-Za-z0-9_.-]", "_", str(colid))
+
+
+class KnownTenants:
+    """colids that exist, i.e. appear on students or participants.
+
+    Tenants are created by requests, so an arbitrary colid must not be able
+    to make a TenantPool scan, create snapshot directories or start
+    watchers; unknown colids are refused before that happens. A colid is
+    looked up with one indexed find_one per collection the first time it
+    is seen, so one registered by another worker is accepted right away;
+    known colids are remembered for good and unknown ones for ttl seconds.
+    """
+
+    def __init__(self, db, ttl=10, collections=("students", "participants"), maxsize=4096):
+        self.db = db
+        self.collections = collections
+        self._lock = threading.Lock()
+        self._known = set()
+        self._unknown = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def __contains__(self, colid):
+        if not colid:
+            return True  # the default tenant always exists
+        colid = str(colid)
+        with self._lock:
+            if colid in self._known:
+                return True
+        if self._unknown.get(colid):
+            return False
+
+        values = [colid, int(colid)] if colid.isdigit() else [colid]
+        if any(self.db[name].find_one({"colid": {"$in": values}}, {"_id": 1}) is not None
+               for name in self.collections):
+            with self._lock:
+                self._known.add(colid)
+            return True
+        self._unknown.put(colid, True)
+        return False
+
+    def add(self, colid):
+        """Accept a colid that was just created"""
+        if colid:
+            self._unknown.pop(str(colid))
+            with self._lock:
+                self._known.add(str(colid))
+
+
+class TenantPool:
+    """LRU of per-tenant in-memory structures (galleries, login indexes) under a memory budget.
+
+    load(colid) builds a tenant's structure on first use; it must have an
+    nbytes() method and may have close(). Whenever the total goes over
+    budget_bytes, or more than max_tenants are resident (empty tenants take
+    no bytes but still hold threads and directories), the least recently
+    used tenants are evicted (never the one just requested), so a large
+    college cannot push everyone else out for long and cold tenants are
+    simply reloaded from MongoDB on their next request.
+    """
+
+    def __init__(self, load, budget_bytes, name="tenant", max_tenants=64):
+        self.load = load
+        self.budget_bytes = budget_bytes
+        self.max_tenants = max_tenants
+        self.name = name
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._loading = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def peek(self, colid):
+        """Loaded structure for a tenant, or None without loading it"""
+        with self._lock:
+            return self._items.get(colid or "")
+
+    def get(self, colid):
+        key = colid or ""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                # Tenants grow as students register, so the budget is rechecked on hits too
+                self._items.move_to_end(key)
+                evicted = self._evict_locked(keep=key)
+            else:
+                loading = self._loading.setdefault(key, threading.Lock())
+        if item is not None:
+            self._close(evicted)
+            return item
+
+        # One loader per tenant; other requests for it wait instead of loading twice
+        with loading:
+            with self._lock:
+                item = self._items.get(key)
+                if item is not None:
+                    self._items.move_to_end(key)
+                    return item
+            item = self.load(colid or None)
+            with self._lock:
+                self._items[key] = item
+                self._loading.pop(key, None)
+                self.loads += 1
+                evicted = self._evict_locked(keep=key)
+        self._close(evicted)
+        return item
+
+    def _close(self, evicted):
+        for key, item in evicted:
+            print(f"Evicted {self.name} {key or DEFAULT_TENANT} to stay within the tenant budget")
+            if hasattr(item, "close"):
+                item.close()
+
+    def _evict_locked(self, keep):
+        evicted = []
+        total = sum(item.nbytes() for item in self._items.values())
+        while (total > self.budget_bytes or len(self._items) > self.max_tenants) and len(self._items) > 1:
+            key = next(iter(self._items))
+            if key == keep:
+                self._items.move_to_end(key)
+                key = next(iter(self._items))
+            old = self._items.pop(key)
+            total -= old.nbytes()
+            evicted.append((key, old))
+            self.evictions += 1
+        return evicted
+
+    def items(self):
+        with self._lock:
+            return list(self._items.values())
+
+    def stats(self):
+        with self._lock:
+            tenants = {key or DEFAULT_TENANT: item.nbytes() for key, item in self._items.items()}
+        return {
+            "tenants": tenants,
+            "bytes": sum(tenants.values()),
+            "budget_bytes": self.budget_bytes,
+            "max_tenants": self.max_tenants,
+            "loads": self.loads,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,113 @@
+from datetime import datetime
+
+import mongomock
+import pytest
+
+import attendance
+from stats import AttendanceStats
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    attendance.ensure_indexes(db)
+    return db
+
+
+def participant(db, name):
+    return db.participants.find_one({"_id": db.participants.insert_one({"name": name}).inserted_id})
+
+
+def test_mark_is_idempotent_per_day(db):
+    alice = participant(db, "alice")
+    morning, evening, next_day = datetime(2024, 3, 1, 9), datetime(2024, 3, 1, 17), datetime(2024, 3, 2, 9)
+
+    assert attendance.mark(db, alice, "lecture", morning)
+    assert not attendance.mark(db, alice, "lecture", evening)
+    assert attendance.mark(db, alice, "lecture", next_day)
+
+    assert db.attendance.count_documents({}) == 2
+    counters = db.participants.find_one({"_id": alice["_id"]})
+    assert counters[attendance.COUNT_FIELD] == 2
+    assert counters[attendance.EVENTS_FIELD] == {"lecture": 2}
+    assert counters[attendance.LAST_SEEN_FIELD] == next_day
+
+
+def test_mark_many_returns_only_new_records(db):
+    alice, bob = participant(db, "alice"), participant(db, "bob")
+    now = datetime(2024, 3, 1, 9)
+    attendance.mark(db, alice, "lecture", now)
+
+    # Already-marked participant last: mongomock numbers upserts by count, not by request index
+    marked = attendance.mark_many(db, [bob, alice], "lecture", now)
+
+    assert [p["name"] for p in marked] == ["bob"]
+    assert db.attendance.count_documents({"event": "lecture"}) == 2
+    assert db.participants.find_one({"_id": alice["_id"]})[attendance.COUNT_FIELD] == 1
+
+
+def test_unmark_takes_record_off_counters(db):
+    alice = participant(db, "alice")
+    attendance.mark(db, alice, "a.b", datetime(2024, 3, 1, 9))
+    record = db.attendance.find_one()
+
+    assert attendance.unmark(db, record["_id"])["_id"] == record["_id"]
+    assert attendance.unmark(db, record["_id"]) is None
+    counters = db.participants.find_one({"_id": alice["_id"]})
+    assert counters[attendance.COUNT_FIELD] == 0
+    assert counters[attendance.EVENTS_FIELD] == {attendance.event_key("a.b"): 0}
+
+
+def test_stats_count_sessions_per_day(db):
+    stats = AttendanceStats(db)
+    now = datetime(2024, 3, 1, 9)
+    stats.marked("lecture", "2024-03-01", 2, now)
+    stats.marked("lecture", "2024-03-01", 1, now)
+    stats.marked("lecture", "2024-03-02", 1, now)
+
+    assert stats.events()["lecture"]["records"] == 4
+    assert stats.events()["lecture"]["sessions"] == 2
+    assert stats.totals()["sessions"] == 2
+
+    stats.unmarked("lecture", "2024-03-02")
+    assert stats.events()["lecture"]["sessions"] == 1
+    stats.unmarked("lecture", "2024-03-01")
+    assert stats.events()["lecture"] == {"records": 2, "sessions": 1, "last_marked": now,
+                                         "average_per_session": 2.0}
+
+
+def test_stats_rebuild_matches_incremental(db):
+    stats = AttendanceStats(db)
+    alice, bob = participant(db, "alice"), participant(db, "bob")
+    for when in (datetime(2024, 3, 1, 9), datetime(2024, 3, 2, 9)):
+        marked = attendance.mark_many(db, [alice, bob], "lecture", when)
+        stats.marked("lecture", attendance.attendance_day(when), len(marked), when)
+    incremental = (stats.totals(), stats.events())
+
+    stats.rebuild()
+    assert (stats.totals(), stats.events()) == incremental
+
+
+def test_participant_percentage_counts_skipped_events(db):
+    stats = AttendanceStats(db)
+    alice = participant(db, "alice")
+    db.participants.update_one({"_id": alice["_id"]}, {"$set": {"class": "A"}})
+    db.events.insert_many([{"name": "maths", "class": "A"}, {"name": "physics", "participants": ["alice"]},
+                           {"name": "other", "class": "B"}])
+    for day in (1, 2):
+        when = datetime(2024, 3, day, 9)
+        stats.marked("physics", attendance.attendance_day(when), 1, when)
+        stats.marked("other", attendance.attendance_day(when), 1, when)
+    for day in (1, 2, 3, 4):
+        when = datetime(2024, 3, day, 9)
+        if day == 1:
+            attendance.mark(db, alice, "maths", when)
+        stats.marked("maths", attendance.attendance_day(when), 1, when)
+
+    result = stats.participant({"_id": alice["_id"]})
+
+    # 1 of 4 maths sessions and none of 2 physics sessions; "other" is not hers
+    assert result["events"]["maths"] == {"attended": 1, "sessions": 4, "attendance_percentage": 25.0}
+    assert result["events"]["physics"]["attendance_percentage"] == 0
+    assert "other" not in result["events"]
+    assert result["attendance_percentage"] == round(100 / 6, 2)
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import numpy as np
+import pytest
+
+from gallery import Gallery, GalleryIndex
+
+DIM = 8
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def worker(db):
+    gallery = Gallery(db, GalleryIndex(db.face_embeddings), model_version="test")
+    gallery.start()
+    return gallery
+
+
+def embedding(seed):
+    return {"Facenet": np.random.default_rng(seed).normal(size=DIM).astype(np.float32)}
+
+
+def names(gallery):
+    return sorted(gallery.get("Facenet")[0])
+
+
+def test_changes_replay_on_other_worker(db):
+    a, b = worker(db), worker(db)
+
+    a.add("alice", embedding(1))
+    a.add("bob", embedding(2))
+    assert b.sync.poll(force=True) == 2
+    assert names(b) == ["alice", "bob"]
+
+    a.remove("alice")
+    assert b.sync.poll(force=True) == 1
+    assert names(b) == ["bob"]
+    assert b.index.sync_version == a.index.sync_version == b.sync.current_version()
+
+
+def test_gap_in_log_reloads_whole_gallery(db):
+    a, b = worker(db), worker(db)
+    a.add("alice", embedding(1))
+    a.add("bob", embedding(2))
+    db.gallery_changes.delete_one({"version": 1})
+
+    # A missing entry may still be in flight, so a fresh gap is waited out
+    assert b.sync.poll(force=True) == 0
+    assert names(b) == []
+
+    db.gallery_changes.update_many({}, {"$set": {"at": datetime.utcnow() - timedelta(minutes=5)}})
+    assert b.sync.poll(force=True) == 1
+    assert names(b) == ["alice", "bob"]
+    assert b.index.sync_version == 2
+
+
+def test_commit_applies_own_change_without_refetch(db):
+    a = worker(db)
+    a.collection.insert_one({"name": "alice", "colid": None, "embeddings": {}})
+
+    # commit() hands over the embeddings, so the empty stored document is never read
+    a.sync.commit("add", "alice", embedding(1))
+    assert names(a) == ["alice"]
+    assert a.index.sync_version == a.sync.current_version() == 1
+    assert a.sync.poll(force=True) == 0
@@ -0,0 +1,76 @@
+import mongomock
+
+from tenants import KnownTenants, TenantPool, tenant_dirname
+
+
+class Tenant:
+    def __init__(self, colid, size):
+        self.colid = colid
+        self.size = size
+        self.closed = False
+
+    def nbytes(self):
+        return self.size
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_evicts_least_recently_used_over_budget():
+    loaded = []
+    pool = TenantPool(lambda colid: loaded.append(colid) or Tenant(colid, 40), budget_bytes=100)
+    a, b = pool.get("a"), pool.get("b")
+    pool.get("a")
+    pool.get("c")
+
+    assert b.closed and not a.closed
+    assert pool.peek("b") is None and pool.peek("a") is a
+    assert pool.get("a") is a and loaded == ["a", "b", "c"]
+    assert pool.stats()["evictions"] == 1
+
+
+def test_pool_caps_tenant_count_even_when_empty():
+    pool = TenantPool(lambda colid: Tenant(colid, 0), budget_bytes=100, max_tenants=3)
+    for i in range(50):
+        pool.get(f"fake-{i}")
+
+    assert len(pool.items()) == 3
+    assert pool.evictions == 47
+
+
+def test_pool_keeps_requested_tenant_even_if_over_budget():
+    pool = TenantPool(lambda colid: Tenant(colid, 500), budget_bytes=100)
+    pool.get("small-budget")
+    big = pool.get("big")
+
+    assert pool.items() == [big]
+
+
+def test_known_tenants_come_from_students_and_participants():
+    db = mongomock.MongoClient().db
+    db.students.insert_many([{"colid": "COL1"}, {"colid": 7}, {"name": "no colid"}])
+    db.participants.insert_one({"name": "x", "colid": "COL2"})
+    known = KnownTenants(db)
+
+    assert None in known and "COL1" in known and "7" in known and "COL2" in known
+    assert "COL3" not in known
+
+
+def test_known_tenants_accept_new_colids():
+    db = mongomock.MongoClient().db
+    known = KnownTenants(db, ttl=0)
+    assert "COL1" not in known
+
+    # Registered by another worker: found on the next lookup
+    db.students.insert_one({"colid": "COL1"})
+    assert "COL1" in known
+
+    cached = KnownTenants(db, ttl=60)
+    assert "COL2" not in cached
+    cached.add("COL2")
+    assert "COL2" in cached
+
+
+def test_tenant_dirname_is_filesystem_safe():
+    assert tenant_dirname(None) == "default"
+    assert tenant_dirname("../etc") == "colid-.._etc"
@@ -1,6 +1,12 @@
 import React, { useEffect } from 'react';
+import { currentColid } from "./global1";
 
 function AdminPage() {
+    // Same college as HomePage enrolls into (see currentColid)
+    const COLID = currentColid();
+    const withColid = (url) =>
+        COLID ? `${url}${url.includes('?') ? '&' : '?'}colid=${encodeURIComponent(COLID)}` : url;
+
     // Global variables
         let participantsData = [];
         let eventsData = [];
@@ -45,7 +51,7 @@ function AdminPage() {
             status.className = "status";
             
             try {
-                const response = await fetch('/api/participants');
+                const response = await fetch(withColid('/api/participants'));
                 const data = await response.json();
                 
                 if (data.status === "success") {
@@ -87,6 +93,8 @@ function AdminPage() {
                         }
                         return '';
                     }).join("");
+                } else if (p.attendance_count) {
+                    attendanceHtml = `${p.attendance_count} records`;
                 }
 
                 tr.innerHTML = `
@@ -129,7 +137,7 @@ function AdminPage() {
             status.className = "status";
             
             try {
-                const response = await fetch(`/api/participants/${encodeURIComponent(name)}`, {
+                const response = await fetch(withColid(`/api/participants/${encodeURIComponent(name)}`), {
                     method: 'DELETE'
                 });
                 const data = await response.json();
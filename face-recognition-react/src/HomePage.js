@@ -1,4 +1,5 @@
 import React, { useEffect } from 'react';
+import { currentColid } from "./global1";
 
 function HomePage() {
   useEffect(() => {
@@ -87,7 +88,13 @@ function HomePage() {
                 const response = await fetch('/api/identify', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ image: currentImage })
+                    body: JSON.stringify({
+                        colid: currentColid(),
+                        image: currentImage,
+                        // Opt-in: match the selected event's roster first, then everyone else
+                        event: (document.getElementById('rosterOnly').checked && eventSelect.value) || undefined,
+                        fallback: true
+                    })
                 });
                 
                 const data = await response.json();
@@ -188,6 +195,7 @@ function HomePage() {
                 
                 if (email) data.email = email;
                 if (phone) data.phone = phone;
+                data.colid = currentColid();
                 
                 const response = await fetch('/api/register', {
                     method: 'POST',
@@ -229,14 +237,18 @@ function HomePage() {
             setStatus(`Registering ${name}...`, "info");
             
             try {
+                const face = currentResults?.unknown_faces?.find(f => f.id === faceId);
                 const data = { 
                     name, 
                     face_id: faceId,
                     image: currentImage
                 };
                 
+                if (face && face.token) data.token = face.token;
+                
                 if (email) data.email = email;
                 if (phone) data.phone = phone;
+                data.colid = currentColid();
                 
                 const response = await fetch('/api/register_unknown', {
                     method: "POST",
@@ -308,19 +320,21 @@ function HomePage() {
             attendanceStatus.innerHTML = '';
             
             try {
-                const promises = currentResults.known_faces.map(person => {
-                    return fetch("/api/mark_attendance", {
-                        method: "POST",
-                        headers: { "Content-Type": "application/json" },
-                        body: JSON.stringify({ 
-                            name: person.name, 
-                            event: eventName 
-                        })
-                    }).then(res => res.json());
+                // One request for everyone recognised in the frame
+                const response = await fetch("/api/mark_attendance/bulk", {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({
+                        names: currentResults.known_faces.map(person => person.name),
+                        event: eventName,
+                        colid: currentColid()
+                    })
                 });
-
-                const results = await Promise.all(promises);
-                const successCount = results.filter(r => r.status === "success").length;
+                const data = await response.json();
+                if (data.error) {
+                    throw new Error(data.error);
+                }
+                const successCount = data.results.filter(r => r.status !== "unknown").length;
                 
                 setStatus(`Attendance marked for ${successCount} people`, "success");
                 attendanceStatus.innerHTML = `
@@ -535,6 +549,9 @@ function HomePage() {
     <div className="section">
         <h2>⚡ Actions</h2>
         <button id="identifyBtn">Identify Faces</button>
+        <label>
+            <input type="checkbox" id="rosterOnly"/> Match the selected event's roster first
+        </label>
         <button id="showRegisterBtn">Register New Person</button>
         
         <div id="registerForm">
@@ -98,6 +98,8 @@ export default function LoginPage() {
     process.env.REACT_APP_API_BASE_URL || "http://localhost:5000";
   const LOGIN_ENDPOINT = process.env.REACT_APP_LOGIN_ENDPOINT || "/login_face";
   const API_URL = `${API_BASE_URL}${LOGIN_ENDPOINT}`;
+  // Optional college id: limits face login to that college's students
+  const COLID = process.env.REACT_APP_COLID || undefined;
 
   // Check camera permissions and available devices
   useEffect(() => {
@@ -276,7 +278,7 @@ export default function LoginPage() {
       const response = await fetch(API_URL, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ image: imageData }),
+        body: JSON.stringify({ image: imageData, colid: COLID }),
       });
 
       if (response.status === 404) {
@@ -1,3 +1,9 @@
-export default {
+const GlobalStore = {
   user: null, 
 };
+
+// College (colid) the backend scopes participants, galleries and attendance to:
+// the signed-in user's, else REACT_APP_COLID
+export const currentColid = () => GlobalStore.user?.colid || process.env.REACT_APP_COLID || undefined;
+
+export default GlobalStore;